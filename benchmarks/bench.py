@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Time norsu's commands against a local stand-in for PostgreSQL's repo.
+
+Usage:
+    benchmarks/bench.py [--sizes 1 10 100] [--repeat 3] [--output FILE]
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from shutil import rmtree
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# don't depend on user's git config
+GIT_ENV = dict(os.environ,
+               GIT_AUTHOR_NAME='Bench',
+               GIT_AUTHOR_EMAIL='bench@localhost',
+               GIT_COMMITTER_NAME='Bench',
+               GIT_COMMITTER_EMAIL='bench@localhost')
+
+CONFIGURE = r'''#!/bin/sh
+srcdir=$(dirname "$0")
+prefix=/usr/local
+args=""
+for a in "$@"; do
+    case "$a" in --prefix=*) prefix="${a#--prefix=}";; esac
+    args="$args '$a'"
+done
+
+mkdir -p src
+echo "autodepend = yes" > src/Makefile.global
+echo "$args" > configure.args
+{ echo "prefix = $prefix"; echo "srcdir = $srcdir"; cat "$srcdir/GNUmakefile.in"; } > GNUmakefile
+
+for c in $(ls "$srcdir/contrib"); do
+    mkdir -p "contrib/$c"
+    printf 'install:\n\t@true\n' > "contrib/$c/Makefile"
+done
+'''
+
+GNUMAKEFILE = '''\
+all:
+\t@touch built
+install: all
+\t@mkdir -p $(prefix)/bin $(prefix)/share $(prefix)/lib/pgxs
+\t@cp $(srcdir)/pg_config.in $(prefix)/bin/pg_config
+\t@chmod +x $(prefix)/bin/pg_config
+\t@touch $(prefix)/bin/postgres
+\t@cp configure.args $(srcdir)/VERSION $(prefix)/share/
+\t@cp $(srcdir)/pgxs.mk $(prefix)/lib/pgxs/pgxs.mk
+distclean:
+\t@rm -f GNUmakefile built configure.args
+'''
+
+# NOTE: pg_config knows its prefix, just like the real one
+PG_CONFIG = r'''#!/bin/sh
+prefix=$(cd "$(dirname "$0")/.." && pwd)
+case "$1" in
+    --version) echo "PostgreSQL $(cat "$prefix/share/VERSION")";;
+    --configure) cat "$prefix/share/configure.args";;
+    --pgxs) echo "$prefix/lib/pgxs/pgxs.mk";;
+    *) exit 1;;
+esac
+'''
+
+PGXS_MK = '''\
+all:
+\t@true
+install: all
+\t@true
+clean:
+\t@true
+installcheck:
+\t@true
+'''
+
+EXTENSION_MAKEFILE = '''\
+PG_CONFIG ?= pg_config
+PGXS := $(shell $(PG_CONFIG) --pgxs)
+include $(PGXS)
+'''
+
+
+def git(repo, *args, stdin=None):
+    return subprocess.run(['git', '-C', repo, *args],
+                          input=stdin,
+                          env=GIT_ENV,
+                          stdout=subprocess.PIPE,
+                          check=True).stdout.decode('utf8').strip()
+
+
+def blob(path, data, mode='100644'):
+    data = data.encode('utf8')
+    return (f'M {mode} inline {path}\ndata {len(data)}\n'.encode('utf8') +
+            data + b'\n')
+
+
+def commit(ref, mark, message, files, parent=None):
+    message = message.encode('utf8')
+    out = (f'commit {ref}\nmark :{mark}\n'
+           f'committer Bench <bench@localhost> {mark} +0000\n'
+           f'data {len(message)}\n').encode('utf8') + message + b'\n'
+
+    if parent:
+        out += f'from :{parent}\n'.encode('utf8')
+
+    for path, (data, mode) in files.items():
+        out += blob(path, data, mode)
+
+    return out + b'\n'
+
+
+def make_upstream(path, majors, minors):
+    """
+    Create a repo with a branch per major version and a tag per minor one.
+    """
+
+    git(os.path.dirname(path), 'init', '-q', '--bare', path)
+
+    files = {
+        'configure': (CONFIGURE, '100755'),
+        'GNUmakefile.in': (GNUMAKEFILE, '100644'),
+        'pg_config.in': (PG_CONFIG, '100755'),
+        'pgxs.mk': (PGXS_MK, '100644'),
+        'src/include/pg_config.h.in': ('', '100644'),
+        'contrib/foo/foo.c': ('', '100644'),
+        'VERSION': ('devel', '100644'),
+    }
+
+    stream = commit('refs/heads/master', 1, 'Initial commit', files)
+    mark = 1
+
+    for major in majors:
+        parent = 1
+        for minor in range(1, minors + 1):
+            mark += 1
+            version = f'{major.replace("_", ".")}.{minor}'
+            stream += commit(f'refs/heads/REL_{major}_STABLE', mark,
+                             f'Stamp {version}',
+                             {'VERSION': (version, '100644')},
+                             parent=parent)
+            stream += f'reset refs/tags/REL_{major}_{minor}\nfrom :{mark}\n\n' \
+                .encode('utf8')
+            parent = mark
+
+    git(path, 'fast-import', '--quiet', stdin=stream)
+
+
+def advance_upstream(path):
+    """
+    Add a commit to every branch (e.g. before pull).
+    """
+
+    branches = git(path, 'for-each-ref', '--format=%(refname)', 'refs/heads')
+    for ref in branches.splitlines():
+        tree = git(path, 'rev-parse', f'{ref}^{{tree}}')
+        new = git(path, 'commit-tree', tree, '-p', ref, '-m', 'Advance')
+        git(path, 'update-ref', ref, new)
+
+
+class Norsu:
+    def __init__(self, norsu_path, upstream):
+        self.env = dict(GIT_ENV,
+                        NORSU_PATH=norsu_path,
+                        PYTHONPATH=ROOT_DIR)
+
+        os.makedirs(norsu_path)
+        with open(os.path.join(norsu_path, '.norsu.toml'), 'w') as f:
+            f.write(f'[repos]\nurls = ["file://{upstream}"]\n')
+
+    def __call__(self, *args, cwd=None):
+        cmd = [sys.executable, '-c', 'from norsu.main import main; main()']
+
+        start = time.perf_counter()
+        p = subprocess.run([*cmd, *args],
+                           env=self.env,
+                           cwd=cwd,
+                           stdout=subprocess.PIPE,
+                           stderr=subprocess.STDOUT)
+        elapsed = time.perf_counter() - start
+
+        if p.returncode != 0:
+            sys.stderr.write(p.stdout.decode('utf8', errors='replace'))
+            raise SystemExit(f'Failed to execute norsu {" ".join(args)}')
+
+        return elapsed
+
+
+def summarize(timings):
+    return {
+        'median': round(statistics.median(timings), 4),
+        'min': round(min(timings), 4),
+        'runs': [round(t, 4) for t in timings],
+    }
+
+
+def bench_size(work_dir, upstream, targets, repeat, parallel):
+    norsu = Norsu(os.path.join(work_dir, 'pg'), upstream)
+    results = {}
+
+    def measure(name, *args, times=repeat, cwd=None):
+        timings = [norsu(*args, cwd=cwd) for _ in range(times)]
+        results[name] = summarize(timings)
+        print(f'\t{name:<16} {results[name]["median"]:.3f}s', flush=True)
+
+    install_opts = ['-P', str(parallel)] if parallel > 1 else []
+
+    measure('search', 'search', *targets)
+    measure('install_cold', 'install', *targets, *install_opts, times=1)
+    measure('install_warm', 'install', *targets, *install_opts)
+    measure('status', 'status', *targets)
+    measure('pull', 'pull', *targets)
+
+    advance_upstream(upstream)
+    measure('pull_changed', 'pull', *targets, times=1)
+
+    ext_dir = os.path.join(work_dir, 'ext')
+    os.makedirs(ext_dir)
+    with open(os.path.join(ext_dir, 'Makefile'), 'w') as f:
+        f.write(EXTENSION_MAKEFILE)
+
+    measure('pgxs', 'pgxs', *targets, '--', 'install', cwd=ext_dir)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100],
+                        help='numbers of targets to benchmark')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of runs of each warm command')
+    parser.add_argument('--majors', type=int, default=15,
+                        help='number of branches in the fake repo')
+    parser.add_argument('--minors', type=int, default=10,
+                        help='number of tags per branch in the fake repo')
+    parser.add_argument('-P', '--parallel', type=int, default=1,
+                        help='pass -P to install')
+    parser.add_argument('--output', help='save results to a JSON file')
+    args = parser.parse_args()
+
+    majors = [f'9_{i}' for i in range(7)] + [str(v) for v in range(10, 100)]
+    majors = majors[:args.majors]
+
+    # branches first, then tags
+    names = [f'REL_{m}_STABLE' for m in majors] + \
+        [f'REL_{m}_{n}' for n in range(1, args.minors + 1) for m in majors]
+
+    if max(args.sizes) > len(names):
+        parser.error(f'not enough branches & tags for {max(args.sizes)} '
+                     'targets, increase --majors or --minors')
+
+    try:
+        commit = git(ROOT_DIR, 'rev-parse', 'HEAD')
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    report = {
+        'commit': commit,
+        'time': int(time.time()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repo': {'branches': len(majors), 'tags': len(majors) * args.minors},
+        'results': {},
+    }
+
+    for size in args.sizes:
+        work_dir = tempfile.mkdtemp(prefix='norsu_bench_')
+        try:
+            upstream = os.path.join(work_dir, 'upstream.git')
+            make_upstream(upstream, majors, args.minors)
+
+            print(f'{size} target(s):', flush=True)
+            report['results'][str(size)] = bench_size(work_dir,
+                                                      upstream,
+                                                      names[:size],
+                                                      args.repeat,
+                                                      args.parallel)
+        finally:
+            rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
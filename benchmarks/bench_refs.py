@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Time ranking of refs (see sort_refs) on a large synthetic set of tags.
+
+Usage:
+    benchmarks/bench_refs.py [--refs 50000] [--repeat 5] [--output FILE]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from norsu.git import GitRef  # noqa: E402
+from norsu.instance import InstanceName, sort_refs  # noqa: E402
+
+
+QUERIES = ['10', '9.6', '13_rc', 'master', 'feature']
+
+
+def make_refs(count, seed=0):
+    """
+    Release tags & branches of lots of forks, plus some feature branches.
+    """
+
+    rnd = random.Random(seed)
+    suffixes = ['', '', '', '_STABLE', '_RC1', '_BETA2', '_ALPHA1']
+    refs = []
+
+    while len(refs) < count:
+        major = rnd.choice([f'9_{i}' for i in range(7)] +
+                           [str(v) for v in range(10, 18)])
+        kind = rnd.random()
+
+        if kind < 0.8:
+            name = f'REL_{major}_{rnd.randint(0, 30)}{rnd.choice(suffixes)}'
+        elif kind < 0.9:
+            name = f'REL{major}_{rnd.randint(0, 30)}'
+        else:
+            name = f'feature_{"".join(rnd.choices("abcdefgh", k=6))}_master'
+
+        refs.append(GitRef(f'fork{len(refs) % 100}', name))
+
+    return refs
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return {
+        'median': round(statistics.median(timings), 4),
+        'min': round(min(timings), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--refs', type=int, default=50000,
+                        help='number of synthetic refs')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of runs of each query')
+    parser.add_argument('--output', help='save results to a JSON file')
+    args = parser.parse_args()
+
+    refs = make_refs(args.refs)
+
+    report = {
+        'time': int(time.time()),
+        'python': platform.python_version(),
+        'refs': len(refs),
+        'results': {},
+    }
+
+    for query in QUERIES:
+        name = InstanceName(query)
+
+        # top-1 is what install needs, full sort is for search
+        best = measure(lambda: sort_refs(refs, name, limit=1), args.repeat)
+        full = measure(lambda: sort_refs(refs, name), args.repeat)
+
+        report['results'][query] = {'best': best, 'sort': full}
+        print(f'{query:<10} best {best["median"]:.4f}s'
+              f'\tsort {full["median"]:.4f}s', flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import fcntl
+import multiprocessing
+
+from contextlib import asynccontextmanager
+
+from norsu.config import CONFIG
+
+
+# async_file_lock() polls a busy lock this often (seconds)
+LOCK_POLL_MIN = 0.01
+LOCK_POLL_MAX = 0.5
+
+
+def concurrency():
+    return CONFIG['misc']['concurrency'] or multiprocessing.cpu_count()
+
+
+async def gather_limited(coros, limit=None):
+    """
+    Await coroutines, running at most limit of them at a time.
+    Exceptions are returned in place of results.
+    """
+
+    # NOTE: asyncio is slow to import, most commands don't need it
+    import asyncio
+
+    semaphore = asyncio.Semaphore(limit or concurrency())
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(c) for c in coros),
+                                return_exceptions=True)
+
+
+def run_all(coros, limit=None):
+    """
+    Synchronous version of gather_limited().
+    """
+
+    import asyncio
+
+    return asyncio.run(gather_limited(coros, limit))
+
+
+@asynccontextmanager
+async def async_file_lock(path):
+    """
+    Same as file_lock(), but doesn't block the event loop.
+    """
+
+    import asyncio
+
+    with open(path, 'a') as f:
+        # NOTE: waiters mustn't hold threads, or they might starve the
+        # executor while the holder needs it (e.g. for a nested lock)
+        delay = LOCK_POLL_MIN
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LOCK_POLL_MAX)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,225 @@
+import hashlib
+import io
+import json
+import os
+import platform
+import re
+import tarfile
+import tempfile
+import time
+
+from functools import lru_cache
+from shutil import rmtree
+
+from norsu.config import CONFIG
+from norsu.exceptions import LogicError, ProcessError
+from norsu.execute import execute
+from norsu.trash import move_to_trash
+
+
+# files of main dir which describe a particular install
+PRIVATE_FILES = re.compile(r'^\.norsu_')
+
+SIZE_UNITS = {'': 1, 'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+
+
+def parse_size(size):
+    m = re.fullmatch(r'\s*(\d+)\s*([KMGT]?)i?B?\s*', str(size), re.I)
+    if not m:
+        raise LogicError(f'Bad size {size}, check artifacts.max_size')
+
+    return int(m.group(1)) * SIZE_UNITS[m.group(2).upper()]
+
+
+@lru_cache(maxsize=None)
+def toolchain_fingerprint(cc='cc'):
+    """
+    Describe things which make a build incompatible with other hosts.
+    """
+
+    try:
+        version = execute([cc, '--version']).splitlines()[0]
+    except (OSError, ProcessError, IndexError):
+        version = None
+
+    return [platform.system(), platform.machine(), *platform.libc_ver(),
+            version]
+
+
+def _relocate_binary(data, old, new):
+    # replace C strings, keeping their length intact
+    def replace(m):
+        # NOTE: e.g. '-L/old/lib -Wl,-rpath,/old/lib'
+        s = m.group(0)[:-1].replace(old, new)
+        return s + b'\0' * (len(m.group(0)) - len(s))
+
+    rx = re.compile(re.escape(old) + rb'[^\0]*\0')
+    return rx.sub(replace, data)
+
+
+def relocate(path, old_prefix, new_prefix):
+    """
+    Replace old install prefix with a new one in all files under path.
+    """
+
+    old = old_prefix.encode('utf8')
+    new = new_prefix.encode('utf8')
+
+    for root, _, files in os.walk(path):
+        for name in files:
+            file = os.path.join(root, name)
+            if os.path.islink(file):
+                continue
+
+            with open(file, 'rb') as f:
+                data = f.read()
+
+            if old not in data:
+                continue
+
+            if b'\0' in data:
+                # binaries have no room for a longer path
+                if len(new) > len(old):
+                    raise LogicError(f'Prefix {new_prefix} is too long '
+                                     f'for artifact built at {old_prefix}')
+                data = _relocate_binary(data, old, new)
+            else:
+                data = data.replace(old, new)
+
+            with open(file, 'wb') as f:
+                f.write(data)
+
+
+class ArtifactStore:
+    """
+    Content-addressed cache of installed builds.
+    """
+
+    def __init__(self, path=None, max_size=None):
+        self.path = path or CONFIG['artifacts']['path']
+        self.max_size = parse_size(max_size or CONFIG['artifacts']['max_size'])
+
+    @staticmethod
+    def enabled():
+        return bool(CONFIG['artifacts']['path'])
+
+    @staticmethod
+    def key(commit, configure, extensions, cc='cc'):
+        data = [commit, configure, extensions, toolchain_fingerprint(cc)]
+        return hashlib.sha1(json.dumps(data).encode('utf8')).hexdigest()
+
+    def _archive(self, key):
+        return os.path.join(self.path, key[:2], f'{key}.tar.gz')
+
+    def restore(self, key, main_dir):
+        """
+        Replace main_dir with a build, return False if there's none.
+        Only norsu's own files (e.g. history of builds) are kept.
+        """
+
+        archive = self._archive(key)
+
+        try:
+            tar = tarfile.open(archive, 'r:gz')
+        except (OSError, tarfile.TarError):
+            return False
+
+        # keep recently used artifacts
+        os.utime(archive)
+
+        parent = os.path.dirname(main_dir)
+        os.makedirs(parent, exist_ok=True)
+
+        tmp_dir = tempfile.mkdtemp(prefix='.norsu_artifact_', dir=parent)
+        try:
+            with tar:
+                meta = json.load(tar.extractfile('.norsu_artifact'))
+
+                options = {}
+                if hasattr(tarfile, 'data_filter'):
+                    options['filter'] = 'data'
+                tar.extractall(tmp_dir, **options)
+
+            os.remove(os.path.join(tmp_dir, '.norsu_artifact'))
+            relocate(tmp_dir, meta['prefix'], main_dir)
+
+            # NOTE: mkdtemp() creates private dirs
+            os.chmod(tmp_dir, 0o755)
+
+            # files of the previous build mustn't linger (e.g. contribs)
+            if os.path.exists(main_dir):
+                for name in os.listdir(main_dir):
+                    if PRIVATE_FILES.match(name):
+                        os.replace(os.path.join(main_dir, name),
+                                   os.path.join(tmp_dir, name))
+
+                move_to_trash(main_dir)
+
+            os.rename(tmp_dir, main_dir)
+        finally:
+            rmtree(tmp_dir, ignore_errors=True)
+
+        return True
+
+    def store(self, key, main_dir):
+        archive = self._archive(key)
+        if os.path.exists(archive):
+            return
+
+        os.makedirs(os.path.dirname(archive), exist_ok=True)
+
+        meta = json.dumps({
+            'prefix': main_dir,
+            'created': int(time.time()),
+        }).encode('utf8')
+
+        # NOTE: other hosts might be looking at the same store
+        fd, tmp = tempfile.mkstemp(prefix='.tmp_',
+                                   dir=os.path.dirname(archive))
+        try:
+            with os.fdopen(fd, 'wb') as f, \
+                    tarfile.open(fileobj=f, mode='w:gz') as tar:
+                info = tarfile.TarInfo('.norsu_artifact')
+                info.size = len(meta)
+                tar.addfile(info, io.BytesIO(meta))
+
+                for name in sorted(os.listdir(main_dir)):
+                    if not PRIVATE_FILES.match(name):
+                        tar.add(os.path.join(main_dir, name), arcname=name)
+
+            # NOTE: mkstemp() creates private files
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, archive)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used artifacts exceeding max size.
+        """
+
+        archives = []
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                if name.endswith('.tar.gz'):
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except FileNotFoundError:
+                        continue  # evicted by someone else
+                    archives.append((stat.st_mtime, stat.st_size,
+                                     os.path.join(root, name)))
+
+        total = sum(size for _, size, _ in archives)
+        for _, size, path in sorted(archives):
+            if total <= self.max_size:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            total -= size
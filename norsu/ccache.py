@@ -0,0 +1,86 @@
+import os
+import shutil
+
+from norsu.config import CONFIG, WORK_DIR
+from norsu.exceptions import LogicError
+
+
+# compilers to be wrapped with ccache
+COMPILERS = ['cc', 'gcc', 'clang', 'c++', 'g++', 'clang++']
+
+# results of compilation (see ccache's stats_log)
+HITS = {'direct_cache_hit', 'preprocessed_cache_hit'}
+MISSES = {'cache_miss'}
+
+
+def ccache_dir():
+    return CONFIG['build']['ccache_dir'] or os.path.join(WORK_DIR, '.ccache')
+
+
+def ccache_env(base_dir, stats_log):
+    """
+    Prepare environment which makes compilers go through ccache.
+    """
+
+    ccache = shutil.which('ccache')
+    if not ccache:
+        raise LogicError('Failed to find ccache, check build.ccache')
+
+    cache_dir = ccache_dir()
+    bin_dir = os.path.join(cache_dir, 'bin')
+    os.makedirs(bin_dir, exist_ok=True)
+
+    # look for real compilers elsewhere
+    path = os.environ.get('PATH', '')
+    search_path = os.pathsep.join(
+        p for p in path.split(os.pathsep)
+        if p and os.path.realpath(p) != os.path.realpath(bin_dir))
+
+    # NOTE: ccache knows which compiler to run by the name of a symlink,
+    # so we don't have to add anything to configure options
+    for name in COMPILERS:
+        link = os.path.join(bin_dir, name)
+        compiler = shutil.which(name, path=search_path)
+        if compiler and os.path.samefile(compiler, ccache):
+            compiler = None  # e.g. /usr/lib/ccache/gcc
+
+        # e.g. configure would pick a 'gcc' that ccache can't find
+        if not compiler:
+            try:
+                os.remove(link)
+            except FileNotFoundError:
+                pass
+            continue
+
+        try:
+            os.symlink(ccache, link)
+        except FileExistsError:
+            pass
+
+    env = dict(os.environ)
+    env['PATH'] = os.pathsep.join([bin_dir, path])
+    env['CCACHE_DIR'] = cache_dir
+    env['CCACHE_MAXSIZE'] = CONFIG['build']['ccache_max_size']
+    env['CCACHE_BASEDIR'] = base_dir
+    env['CCACHE_STATSLOG'] = stats_log
+
+    return env
+
+
+def read_stats_log(path):
+    """
+    Count cache hits and misses recorded in a stats log.
+    """
+
+    hits, misses = 0, 0
+
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            for ln in f:
+                ln = ln.strip()
+                if ln in HITS:
+                    hits += 1
+                elif ln in MISSES:
+                    misses += 1
+
+    return hits, misses
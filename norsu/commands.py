@@ -1,25 +1,39 @@
+import json
 import os
 import subprocess
 import sys
+import tempfile
+import time
 
-from distutils.spawn import find_executable
-from shutil import rmtree
+from glob import glob
 
-from norsu.exceptions import LogicError
+from functools import partial
+from shutil import copytree, ignore_patterns, rmtree, which
+
+from norsu.aio import gather_limited, run_all
+from norsu.dedupe import dedupe
+from norsu.exceptions import LogicError, ProcessError
 from norsu.extension import Extension
-from norsu.git import find_relevant_refs
+from norsu.git import GitMirror, find_relevant_refs_async
+from norsu.jobserver import JobServer
+from norsu.parallel import run_parallel
+from norsu.pool import POOL_SOCKET, request_pool, start_pool
+from norsu.stats import PHASES, find_regressions, read_stats, total_time
+from norsu.targets import known_targets, preprocess_targets
+from norsu.trash import dir_size, empty_trash, move_to_trash
 
 from norsu.config import (
-    NORSU_DIR,
     WORK_DIR,
     CONFIG,
 )
 
 from norsu.instance import (
+    SOURCES_DIR,
     Instance,
-    InstanceName,
+    build_jobs,
     sort_refs,
     run_temp,
+    source_lock,
 )
 
 from norsu.terminal import (
@@ -28,33 +42,12 @@ from norsu.terminal import (
 )
 
 from norsu.utils import (
+    format_size,
     partition,
     str_args_to_dict,
 )
 
 
-def known_targets(directory=NORSU_DIR):
-    return {e for e in os.listdir(directory) if not e.startswith('.')}
-
-
-def preprocess_targets(raw_targets, directory=NORSU_DIR):
-    entries_pos, entries_neg = partition(lambda x: x.startswith('^'),
-                                         raw_targets)
-
-    entries_neg = set((e[1:] for e in entries_neg))  # remove '^'
-    entries_pos = set(entries_pos)
-
-    if not entries_pos or entries_neg:
-        entries_pos = known_targets(directory=directory)
-
-    entries = []
-    for e in sorted(entries_pos - entries_neg):
-        name, _, query = e.partition(':')
-        entries.append(InstanceName(name=name, query=query))
-
-    return entries
-
-
 def split_make_args(args):
     entries, options = partition(lambda x: x.startswith('-'), args)
 
@@ -64,16 +57,50 @@ def split_make_args(args):
     return entries, options
 
 
-def cmd_install(args, _):
-    for target in preprocess_targets(args.target):
-        print('Selected instance:', Style.bold(target))
+def install_target(target, **kwargs):
+    print('Selected instance:', Style.bold(target))
+    Instance(target).install(**kwargs)
 
-        Instance(target).install(configure=args.configure,
-                                 extensions=args.extensions,
-                                 update=not args.no_update)
 
+def cmd_install(args, _):
+    targets = preprocess_targets(args.target)
+    workers = args.parallel or CONFIG['build']['parallel']
+
+    kwargs = {
+        'configure': args.configure,
+        'extensions': args.extensions,
+        'update': not args.no_update,
+        'refresh': args.refresh,
+    }
+
+    if workers <= 1 or len(targets) <= 1:
+        for target in targets:
+            install_target(target, **kwargs)
+            print()  # splitter
+        return
+
+    failed = {}
+
+    # split job budget across concurrent builds
+    with JobServer(build_jobs()):
+        func = partial(install_target, **kwargs)
+        for target, output, error in run_parallel(func, targets, workers):
+            prefix = Style.bold(f'[{target}]')
+            for ln in output.splitlines():
+                print(prefix, ln)
+            print()  # splitter
+
+            if error:
+                failed[str(target)] = error
+
+    if failed:
+        print('Failed instances:')
+        for name in sorted(failed):
+            print('\t', Style.bold(name), Style.red(failed[name]))
         print()  # splitter
 
+        raise LogicError(f'Failed to install {len(failed)} instance(s)')
+
 
 def cmd_instance(args, _):
     cmd = args.command
@@ -88,9 +115,7 @@ def cmd_instance(args, _):
         instance = Instance(target)
 
         cmds = {
-            'pull': lambda: instance.pull(),
             'remove': lambda: instance.remove(),
-            'status': lambda: instance.status(),
         }
 
         # execute command
@@ -98,8 +123,191 @@ def cmd_instance(args, _):
 
         print()  # splitter
 
+    # actually remove files in background
+    empty_trash()
+
+
+async def pull_remote(url, instances):
+    """
+    Pull work dirs cloned from the same remote repo.
+    Return a dict: src_dir => (old commit, new commit, distance).
+    """
+
+    # cheap check: skip branches which haven't moved
+    remote_hashes = await gather_limited(i.git.remote_branch_hash_async()
+                                         for i in instances)
+
+    results = {}
+    for instance, remote_hash in zip(instances, remote_hashes):
+        commit = instance.git.hash
+        if remote_hash == commit:
+            results[instance.src_dir] = (commit, commit, 0)
+
+    instances = [i for i in instances if i.src_dir not in results]
+    if not instances:
+        return results
+
+    # a single fetch of all branches serves all work dirs cloned from mirror
+    mirror = GitMirror(url)
+    if os.path.exists(mirror.path):
+        try:
+            await mirror.update_async()
+        except ProcessError as e:
+            return {**results, **{i.src_dir: e for i in instances}}
+
+    # now fetch & fast-forward work dirs (mostly locally)
+    pulled = await gather_limited(i.pull_async() for i in instances)
+    results.update({i.src_dir: r for i, r in zip(instances, pulled)})
+
+    return results
+
+
+def cmd_pull(args, _):
+    instances = [Instance(t) for t in preprocess_targets(args.target)]
+
+    notes = {}  # target => reason to skip
+    groups = {}  # remote url => {src_dir: instance}
+
+    for instance in instances:
+        if os.path.exists(instance.main_dir) and \
+                not os.path.exists(instance.work_dir):
+            notes[instance] = 'standalone build, skipped'
+
+        elif not os.path.exists(os.path.join(instance.src_dir, '.git')):
+            # clone it as before
+            print('Selected instance:', Style.bold(instance.name))
+            instance.pull()
+            print()  # splitter
+
+            notes[instance] = 'cloned'
+
+        elif not instance.git.branch:
+            notes[instance] = 'not a branch, skipped'
+
+        else:
+            # NOTE: shared sources are pulled once
+            group = groups.setdefault(instance.git.upstream_url, {})
+            group.setdefault(instance.src_dir, instance)
+
+    results = {}
+    for group in run_all(pull_remote(url, list(dirs.values()))
+                         for url, dirs in groups.items()):
+        if isinstance(group, Exception):
+            raise group
+        results.update(group)
+
+    failed = 0
+
+    print('\t'.join(['target', 'old commit', 'new commit', 'commits']))
+    for instance in instances:
+        old, new, distance = '-', '-', '-'
+        note = notes.get(instance, '')
+
+        result = results.get(instance.src_dir)
+        if instance in notes:
+            pass
+
+        elif isinstance(result, Exception):
+            note = Style.red(str(result) or 'Failed to pull')
+            failed += 1
+
+        elif result:
+            old, new = result[0][:10], result[1][:10]
+            if result[0] == result[1]:
+                distance = '0'
+            elif result[2] is not None:
+                distance = str(result[2])
+            else:
+                distance = '?'  # e.g. history has been rewritten
+
+            if instance.requires_reinstall:
+                note = Style.yellow('installed build is out of date')
+
+        print('\t'.join([Style.bold(str(instance.name)), old, new, distance,
+                         note]))
+
+    print()  # splitter
+
+    if failed:
+        raise LogicError(f'Failed to pull {failed} instance(s)')
+
+
+def cmd_status(args, _):
+    targets = preprocess_targets(args.target)
+    infos = run_all(Instance(target).info_async() for target in targets)
+
+    for info in infos:
+        if isinstance(info, Exception):
+            raise info
+
+    if args.json:
+        print(json.dumps(infos, indent=2))
+        return
+
+    for target, info in zip(targets, infos):
+        print('Selected instance:', Style.bold(target))
+        Instance(target).status(info)
+        print()  # splitter
+
+
+def cmd_stats(args, _):
+    targets = preprocess_targets(args.target)
+
+    if args.json:
+        result = {
+            str(target): read_stats(Instance(target).build_stats_file)
+            for target in targets
+        }
+        print(json.dumps(result, indent=2))
+        return
+
+    for target in targets:
+        print('Selected instance:', Style.bold(target))
+
+        entries = read_stats(Instance(target).build_stats_file)
+        if not entries:
+            print('No builds recorded')
+            print()  # splitter
+            continue
+
+        phases = [p for p in PHASES if any(p in e['phases'] for e in entries)]
+        regressions = find_regressions(entries)
+
+        print('\t'.join(['date\t\t', 'commit\t', 'jobs', *phases, 'total']))
+
+        shown = entries[-args.last:]
+        for i, entry in enumerate(shown):
+            latest = i == len(shown) - 1
+            date = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['time']))
+            row = [date, entry['commit'][:8], str(entry['jobs'])]
+
+            for phase in phases:
+                value = entry['phases'].get(phase)
+                text = '{:.1f}'.format(value['wall']) if value else '-'
+                if latest and phase in regressions:
+                    text = Style.red(text)
+                row.append(text)
+
+            row.append('{:.1f}'.format(total_time(entry)))
+            print('\t'.join(row))
+
+        latest = entries[-1]
+        print()
+        print('CPU time of latest build:', '{:.1f}s'.format(total_time(latest, 'cpu')))
+        print('Peak RSS of latest build:', '{} MiB'.format(
+            max(p['rss'] for p in latest['phases'].values()) // 1024))
+
+        for phase, (wall, median) in regressions.items():
+            print(Style.red('Regression:'), Style.bold(phase),
+                  '{:.1f}s (median {:.1f}s)'.format(wall, median))
+
+        print()  # splitter
+
 
 def cmd_run(main_args, cli_args):
+    if main_args.target not in known_targets():
+        raise LogicError(f'Unknown instance {main_args.target}')
+
     instance = Instance(main_args.target)
     dbname = main_args.dbname
     port = main_args.port
@@ -135,7 +343,7 @@ def cmd_run(main_args, cli_args):
             # or it should be in PATH
             exe = instance.get_bin_path(cli)
             if not os.path.exists(exe):
-                exe = find_executable(cli)
+                exe = which(cli)
             cmd = [
                 exe,
                 f'postgres://localhost:{node.port}/{dbname}',
@@ -163,13 +371,20 @@ def cmd_run(main_args, cli_args):
 
 
 def cmd_search(args, _):
-    for target in preprocess_targets(args.target):
+    targets = preprocess_targets(args.target)
+    results = run_all(
+        find_relevant_refs_async(CONFIG['repos']['urls'],
+                                 target.to_patterns(),
+                                 refresh=args.refresh)
+        for target in targets)
+
+    for target, refs in zip(targets, results):
+        if isinstance(refs, Exception):
+            raise refs
+
         print('Search query:', Style.bold(target.query),
               f'({target.type.name})')
 
-        patterns = target.to_patterns()
-        refs = find_relevant_refs(CONFIG['repos']['urls'], patterns)
-
         for ref in sort_refs(refs, target):
             print('\t', ref.name)
 
@@ -177,47 +392,153 @@ def cmd_search(args, _):
 
 
 def cmd_purge(args, _):
+    garbage = []
+
     for target in preprocess_targets(args.target, WORK_DIR):
         instance = Instance(target)
         if not os.path.exists(instance.main_dir):
-            rmtree(path=instance.work_dir, ignore_errors=True)
+            garbage.append(instance.work_dir)
 
+    # remove sources which are no longer used by VPATH builds
+    used = {Instance(t).src_dir for t in known_targets(WORK_DIR)
+            if Instance(t).work_dir not in garbage}
+    for src_dir in glob(os.path.join(SOURCES_DIR, '*', '*')):
+        if os.path.isdir(src_dir) and src_dir not in used:
+            garbage.append(src_dir)
 
-def cmd_pgxs(main_args, make_args):
-    make_targets, make_opts = split_make_args(make_args)
-    work_dir = os.getcwd()
+    # NOTE: locks of garbage are no longer of any use
+    for path in garbage:
+        if os.path.exists(source_lock(path)):
+            os.remove(source_lock(path))
 
-    for pg in preprocess_targets(main_args.target):
-        instance = Instance(pg)
-        pg_config = instance.get_bin_path('pg_config')
-        extension = Extension(work_dir=work_dir, pg_config=pg_config)
+    reclaimed = 0
+    for path in garbage:
+        reclaimed += dir_size(path)
+        move_to_trash(path)
+        print('Removed', path)
 
-        if os.path.exists(pg_config):
-            print('Executing against instance', Style.bold(pg), '\n')
-        else:
-            print(Style.yellow(f'Cannot find instance {pg}\n'))
-            continue
+    empty_trash()
+    print('Reclaimed', format_size(reclaimed))
 
-        # should we start PostgreSQL?
-        if main_args.run_pg:
-            port = main_args.run_pg_port
 
-            mk_var = 'EXTRA_REGRESS_OPTS'
-            regress_opts = str_args_to_dict(extension.makefile_var(mk_var))
-            config_files = [regress_opts.get('--temp-config')]
+def cmd_dedupe(args, _):
+    main_dirs = [Instance(t).main_dir for t in preprocess_targets(args.target)]
+    main_dirs = [d for d in main_dirs if os.path.isdir(d)]
 
-            # run commands under a running PostgreSQL instance
-            with run_temp(instance, config_files=config_files,
-                          port=port) as node:
-                # make pg_regress aware of non-default port
-                make_opts.append(f'{mk_var}+=--port={node.port}')
-                extension.make(*make_targets, options=make_opts)
-        else:
+    linked, reclaimed = dedupe(main_dirs)
+    print('Hardlinked', linked, 'files')
+    print('Reclaimed', format_size(reclaimed))
+
+
+def pgxs_target(pg, work_dir, make_targets, make_opts, run_pg, port=None):
+    instance = Instance(pg)
+    pg_config = instance.get_bin_path('pg_config')
+    extension = Extension(work_dir=work_dir, pg_config=pg_config)
+    make_opts = make_opts[:]
+
+    # should we start PostgreSQL?
+    if run_pg:
+        mk_var = 'EXTRA_REGRESS_OPTS'
+        regress_opts = str_args_to_dict(extension.makefile_var(mk_var))
+        config_files = [regress_opts.get('--temp-config')]
+
+        # run commands under a running PostgreSQL instance
+        with run_temp(instance, config_files=config_files,
+                      port=port) as node:
+            # make pg_regress aware of non-default port
+            make_opts.append(f'{mk_var}+=--port={node.port}')
             extension.make(*make_targets, options=make_opts)
+    else:
+        extension.make(*make_targets, options=make_opts)
 
-        print()  # splitter
 
+def pgxs_target_copy(pg, work_dir, **kwargs):
+    if not os.path.exists(Instance(pg).get_bin_path('pg_config')):
+        raise LogicError(f'Cannot find instance {pg}')
 
-def cmd_path(args, _):
-    for target in preprocess_targets(args.target):
-        print(Instance(target).main_dir)
+    # concurrent builds (e.g. 'make clean') must not collide
+    copy_dir = tempfile.mkdtemp(prefix=f'norsu_pgxs_{pg}_')
+    copy_dir = os.path.join(copy_dir, os.path.basename(work_dir))
+    copytree(work_dir, copy_dir, symlinks=True, ignore=ignore_patterns('.git'))
+
+    print('Executing against instance', Style.bold(pg), 'in', copy_dir, '\n')
+
+    pgxs_target(pg, copy_dir, **kwargs)
+
+    # keep the copy (e.g. regression.diffs) if something has failed
+    rmtree(path=os.path.dirname(copy_dir), ignore_errors=True)
+
+
+def cmd_pgxs(main_args, make_args):
+    make_targets, make_opts = split_make_args(make_args)
+    work_dir = os.getcwd()
+    targets = preprocess_targets(main_args.target)
+
+    kwargs = {
+        'make_targets': make_targets,
+        'make_opts': make_opts,
+        'run_pg': main_args.run_pg,
+    }
+
+    workers = main_args.parallel or 1
+    if workers <= 1 or len(targets) <= 1:
+        for pg in targets:
+            pg_config = Instance(pg).get_bin_path('pg_config')
+
+            if os.path.exists(pg_config):
+                print('Executing against instance', Style.bold(pg), '\n')
+            else:
+                print(Style.yellow(f'Cannot find instance {pg}\n'))
+                continue
+
+            pgxs_target(pg, work_dir, port=main_args.run_pg_port, **kwargs)
+            print()  # splitter
+        return
+
+    if main_args.run_pg_port:
+        raise LogicError('Cannot use --run-pg-port with --parallel')
+
+    results = {}
+
+    func = partial(pgxs_target_copy, work_dir=work_dir, **kwargs)
+    for pg, output, error in run_parallel(func, targets, workers):
+        prefix = Style.bold(f'[{pg}]')
+        for ln in output.splitlines():
+            print(prefix, ln)
+        print()  # splitter
+
+        results[str(pg)] = error
+
+    print('Summary:')
+    for pg in targets:
+        error = results[str(pg)]
+        result = Style.red(f'FAILED: {error}') if error else Style.green('OK')
+        print('\t', Style.bold(pg), f'\t{result}')
+    print()  # splitter
+
+    failed = [pg for pg, error in results.items() if error]
+    if failed:
+        raise LogicError(f'Failed for {len(failed)} instance(s)')
+
+
+def cmd_pool(args, _):
+    if args.action == 'start':
+        instances = []
+        for target in preprocess_targets(args.target):
+            instance = Instance(target)
+            if os.path.exists(instance.get_bin_path('pg_config')):
+                instances.append(instance)
+            else:
+                print(Style.yellow(f'Cannot find instance {target}'))
+
+        start_pool(instances, args.size or CONFIG['pool']['size'])
+        print('Node pool is listening on', POOL_SOCKET)
+
+    elif args.action == 'stop':
+        request_pool('stop')
+        print('Node pool has been stopped')
+
+    else:
+        for target, nodes in request_pool('status').items():
+            print('\t', Style.bold(target),
+                  f"\t{nodes['idle']} idle, {nodes['leased']} leased")
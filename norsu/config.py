@@ -1,5 +1,5 @@
+import json
 import os
-import toml
 
 
 def merge_config(current, new):
@@ -32,31 +32,83 @@ CONFIG = {
             'https://git.postgresql.org/git/postgresql.git',
         ],
         'first_match': True,
+        'mirror': True,
+        'clone': 'blobless',
+        'cache_ttl': 3600,
+        'timeout': 30,
     },
     'commands': {},
     'build': {
         'configure_options': ['CFLAGS=-g3', '--enable-cassert'],
         'jobs': 0,
+        'parallel': 1,
+        'vpath': False,
+        'ccache': False,
+        'ccache_dir': '',
+        'ccache_max_size': '5G',
+        'keep_logs': 3,
+        'dedupe': False,
     },
     'pgxs': {
         'default_targets': ['clean', 'install'],
         'default_options': [],
     },
+    'artifacts': {
+        'path': '',
+        'max_size': '20G',
+    },
+    'pool': {
+        'size': 2,
+    },
     'tools': {
         'make': 'make',
     },
     'misc': {
         'colors': True,
+        'progress': True,
+        'concurrency': 8,
     }
 }
 
 cfg = os.path.join(NORSU_DIR, '.norsu.toml')
 
+# parsed config file (TOML is slow to import & parse)
+cfg_cache = os.path.join(WORK_DIR, '.norsu.toml.json')
+
+
+def load_config_file(path, cache_path):
+    stat = os.stat(path)
+    key = [stat.st_mtime_ns, stat.st_size]
+
+    try:
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+        if cache['key'] == key:
+            return cache['config']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    import toml
+
+    with open(path, 'r') as f:
+        config = toml.loads(f.read())
+
+    try:
+        with open(f'{cache_path}.tmp', 'w') as f:
+            json.dump({'key': key, 'config': config}, f)
+        os.replace(f'{cache_path}.tmp', cache_path)
+    except (OSError, TypeError):
+        pass  # e.g. a TOML date
+
+    return config
+
+
 if not os.path.exists(cfg):
+    import toml
+
     with open(cfg, 'w') as f:
         f.write(toml.dumps(CONFIG))
 else:
-    with open(cfg, 'r') as f:
-        merge_config(CONFIG, toml.loads(f.read()))
+    merge_config(CONFIG, load_config_file(cfg, cfg_cache))
 
 TOOL_MAKE = CONFIG['tools']['make']
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import stat
+
+from norsu.artifacts import PRIVATE_FILES
+from norsu.config import NORSU_DIR, WORK_DIR
+from norsu.utils import file_lock
+
+
+# hashes of installed files, keyed by path, size, mtime and inode
+INDEX_FILE = os.path.join(WORK_DIR, '.dedupe.json')
+
+
+def installed_dirs():
+    return [
+        os.path.join(NORSU_DIR, e) for e in sorted(os.listdir(NORSU_DIR))
+        if not e.startswith('.') and os.path.isdir(os.path.join(NORSU_DIR, e))
+    ]
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def _key(st):
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def _walk(main_dir):
+    for root, _, files in os.walk(main_dir):
+        for name in files:
+            # these are rewritten in place, see write_commit_file
+            if root == main_dir and PRIVATE_FILES.match(name):
+                continue
+
+            path = os.path.join(root, name)
+            try:
+                st = os.lstat(path)
+            except FileNotFoundError:
+                continue
+
+            # nothing to gain from empty files
+            if stat.S_ISREG(st.st_mode) and st.st_size > 0:
+                yield path, st
+
+
+def _load_index():
+    try:
+        with open(INDEX_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_index(index):
+    with open(f'{INDEX_FILE}.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(f'{INDEX_FILE}.tmp', INDEX_FILE)
+
+
+def _link(src, dst):
+    # atomically replace dst, so that nobody sees it missing
+    tmp = os.path.join(os.path.dirname(dst),
+                       f'.{os.path.basename(dst)}.{os.urandom(4).hex()}')
+
+    os.link(src, tmp)
+    try:
+        os.replace(tmp, dst)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def dedupe(main_dirs, only=None):
+    """
+    Replace identical files of main dirs with hardlinks to one of them.
+    Given a main dir (only), just its files are replaced (e.g. with links
+    to files of other builds), the rest are left intact.
+    Returns (number of linked files, bytes reclaimed).
+    """
+
+    with file_lock(f'{INDEX_FILE}.lock'):
+        files = {}  # path => stat
+        for main_dir in main_dirs:
+            files.update(_walk(main_dir))
+
+        # keep hashes of files which haven't changed
+        index = {
+            path: entry for path, entry in _load_index().items()
+            if path in files and entry[:3] == _key(files[path])
+        }
+
+        # only files of the same size might be identical
+        by_size = {}
+        for path, st in files.items():
+            by_size.setdefault(st.st_size, []).append(path)
+
+        if only:
+            only = os.path.join(only, '')
+
+        def ours(path):
+            return path.startswith(only) if only else True
+
+        linked = 0
+        replaced = {}  # inode => [links replaced, total links, size]
+
+        for paths in by_size.values():
+            if len(paths) < 2:
+                continue
+
+            if not any(ours(p) for p in paths):
+                continue
+
+            groups = {}
+            for path in sorted(paths):
+                st = files[path]
+
+                if path not in index:
+                    try:
+                        index[path] = _key(st) + [file_hash(path)]
+                    except OSError:
+                        continue
+
+                # NOTE: links share mode & owner, so they must match
+                group = (index[path][3], st.st_dev, st.st_mode, st.st_uid,
+                         st.st_gid)
+                groups.setdefault(group, []).append(path)
+
+            for group in groups.values():
+                # others will join the file with most links
+                # (preferably one of the builds we mustn't touch)
+                src = max(group,
+                          key=lambda p: (not ours(p), files[p].st_nlink))
+                src_st = files[src]
+
+                for dst in group:
+                    dst_st = files[dst]
+                    if dst_st.st_ino == src_st.st_ino or not ours(dst):
+                        continue
+
+                    try:
+                        # don't touch files that have changed since hashing
+                        if _key(os.lstat(src)) != _key(src_st) or \
+                                _key(os.lstat(dst)) != _key(dst_st):
+                            continue
+
+                        _link(src, dst)
+                    except OSError:
+                        continue  # e.g. too many links
+
+                    inode = (dst_st.st_dev, dst_st.st_ino)
+                    replaced.setdefault(inode, [0, dst_st.st_nlink,
+                                                dst_st.st_blocks * 512])
+                    replaced[inode][0] += 1
+
+                    index[dst] = _key(src_st) + [index[src][3]]
+                    linked += 1
+
+        _save_index(index)
+
+    # space is reclaimed once all links of a file are gone
+    reclaimed = sum(size for links, nlink, size in replaced.values()
+                    if links >= nlink)
+
+    return linked, reclaimed
@@ -2,9 +2,10 @@ class ProcessError(Exception):
     """
     This exception represents a failed invocation of an external tool.
     """
-    def __init__(self, message='', stderr=None):
+    def __init__(self, message='', stderr=None, log=None):
         super().__init__(message)
         self.stderr = stderr
+        self.log = log  # full output, if it's been saved
 
 
 class LogicError(Exception):
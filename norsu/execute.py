@@ -1,10 +1,17 @@
 import subprocess
+import threading
 
+from collections import deque
 from enum import Enum
+from typing import Callable, Optional
 
 from norsu.exceptions import ProcessError
 
 
+# how many lines of output are kept for error reports
+TAIL_LINES = 100
+
+
 class ExecOutput(Enum):
     """
     Possible outputs of a spawned subprocess.
@@ -15,21 +22,117 @@ class ExecOutput(Enum):
     Devnull = subprocess.DEVNULL
 
 
+def _stream(p, log, progress):
+    """
+    Read output line by line, keeping only the tail of it in memory.
+    """
+
+    tail = deque(maxlen=TAIL_LINES)
+
+    with open(log, 'wb') if log else open('/dev/null', 'wb') as f:
+        for raw in iter(p.stdout.readline, b''):
+            f.write(raw)
+
+            ln = raw.decode('utf8', errors='replace').rstrip('\n')
+            tail.append(ln)
+
+            if progress:
+                progress(ln)
+
+    p.wait()
+    return '\n'.join(tail)
+
+
 def execute(args,
             error: bool = True,
             output: ExecOutput = ExecOutput.Pipe,
+            timeout: Optional[float] = None,
+            log: Optional[str] = None,
+            progress: Optional[Callable[[str], None]] = None,
             **kwargs):
+    """
+    Run a command and return its output (if piped).
+    Given a log file or a progress callback, output is streamed to
+    them, and only its last TAIL_LINES lines are returned.
+    """
+
     p = subprocess.Popen(args,
                          stdout=output.value,
                          stderr=subprocess.STDOUT,
                          **kwargs)
 
-    if output == ExecOutput.Pipe:
-        out, _ = p.communicate()
-        out = out.decode('utf8')
-    else:
-        p.wait()
-        out = None
+    streaming = output == ExecOutput.Pipe and (log or progress)
+    timed_out = threading.Event()
+
+    try:
+        if streaming:
+            # readline() can't time out, so kill the process instead
+            def kill():
+                timed_out.set()
+                p.kill()
+
+            timer = threading.Timer(timeout, kill) if timeout else None
+            if timer:
+                timer.start()
+
+            try:
+                out = _stream(p, log, progress)
+            finally:
+                if timer:
+                    timer.cancel()
+
+            if timed_out.is_set():
+                raise subprocess.TimeoutExpired(args, timeout)
+
+        elif output == ExecOutput.Pipe:
+            out, _ = p.communicate(timeout=timeout)
+            out = out.decode('utf8')
+        else:
+            p.wait(timeout=timeout)
+            out = None
+    except subprocess.TimeoutExpired:
+        p.kill()
+        p.communicate()
+        raise ProcessError('Timed out executing {}'.format(' '.join(args)),
+                           log=log)
+
+    if p.returncode != 0:
+        if error:
+            raise ProcessError('Failed to execute {}'.format(' '.join(args)),
+                               stderr=out,  # attach output if possible
+                               log=log)
+
+    return out
+
+
+async def execute_async(args,
+                        error: bool = True,
+                        output: ExecOutput = ExecOutput.Pipe,
+                        timeout: Optional[float] = None,
+                        **kwargs):
+    """
+    Same as execute(), but lets other coroutines run meanwhile.
+    """
+
+    # NOTE: asyncio is slow to import, most commands don't need it
+    import asyncio
+
+    p = await asyncio.create_subprocess_exec(*args,
+                                             stdout=output.value,
+                                             stderr=subprocess.STDOUT,
+                                             **kwargs)
+
+    try:
+        if output == ExecOutput.Pipe:
+            out, _ = await asyncio.wait_for(p.communicate(), timeout)
+            out = out.decode('utf8')
+        else:
+            await asyncio.wait_for(p.wait(), timeout)
+            out = None
+    except asyncio.TimeoutError:
+        p.kill()
+        await p.communicate()
+        raise ProcessError('Timed out executing {}'.format(' '.join(args)))
 
     if p.returncode != 0:
         if error:
@@ -1,57 +1,120 @@
+import configparser
+import hashlib
+import json
 import os
+import re
+import time
 
-from functools import total_ordering
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
+from functools import lru_cache
 
-from norsu.config import CONFIG
-from norsu.execute import ExecOutput, execute
+from norsu.aio import async_file_lock, gather_limited
+from norsu.config import CONFIG, WORK_DIR
+from norsu.exceptions import LogicError, ProcessError
+from norsu.execute import ExecOutput, execute, execute_async
+from norsu.terminal import Style
+from norsu.utils import eprint, file_lock
 
 
-@total_ordering
-class SortRefByVersion:
-    def __init__(self, ref):
-        # use lowercase for substr search
-        name = ref.name.lower()
-
-        # extract version numbers
-        ver = ''.join((c for c in name if c.isdigit() or c == '_'))
-        ver = (n for n in ver.split('_') if n)
-        ver = list(map(lambda n: int(n), ver))
-
-        types = [
-            ('stable', float('+inf')),
-            ('rc', -1),
-            ('beta', -2),
-            ('alpha', -3),
-        ]
+MIRRORS_DIR = os.path.join(WORK_DIR, '.mirrors')
+REFS_DIR = os.path.join(WORK_DIR, '.refs')
 
-        for t, num in types:
-            if t in name:
-                # example:
-                #  REL_10_RC1 => (10, -1, 1)
-                #  REL_9_6_STABLE => (9, 6, 'inf')
-                _, _, s = name.rpartition(t)
-                if s.isdigit():
-                    ver.pop()  # see ver extraction
-                    ver.append(num)
-                    ver.append(int(s))
-                else:
-                    ver.append(num)
+# NOTE: inherited by forked workers of the same command
+RUN_STARTED = time.time()
+
+# options of 'git clone' for each repos.clone strategy (w/o mirror)
+CLONE_STRATEGIES = {
+    'shallow': ['--depth', '1'],
+    'blobless': ['--filter=blob:none'],
+    'full': [],
+}
+
+# shallow history is deepened by this many commits at first...
+DEEPEN_MIN = 16
+
+# ... twice as many each time, giving up past this depth
+DEEPEN_MAX = 4096
+
+
+def repo_id(url):
+    name = os.path.basename(url.rstrip('/'))
+    name = os.path.splitext(name)[0]
+    digest = hashlib.sha1(url.encode('utf8')).hexdigest()[:8]
+
+    return f'{name}-{digest}'
+
+
+def read_origin_url(git_dir):
+    """
+    Read URL of origin from git config without spawning git.
+    """
+
+    config = configparser.ConfigParser(strict=False, interpolation=None)
 
-        self.ref = ref
-        self.ver = ver
+    try:
+        config.read(os.path.join(git_dir, 'config'))
+    except configparser.Error:
+        return None
 
-    def __eq__(self, other):
-        return self.ver == other.ver
+    return config.get('remote "origin"', 'url', fallback=None)
 
-    def __lt__(self, other):
-        return self.ver < other.ver
 
-    def __str__(self):
-        return self.ref
+# suffixes of a version, e.g. REL_10_RC1
+VERSION_TYPES = [
+    ('stable', float('+inf')),
+    ('rc', -1),
+    ('beta', -2),
+    ('alpha', -3),
+]
+
+rx_not_ver = re.compile(r'[^\d_]')
+
+
+@lru_cache(maxsize=None)
+def ref_version(name):
+    """
+    Version numbers of a ref, e.g. REL_10_RC1 => (10, -1, 1).
+    """
+
+    # use lowercase for substr search
+    name = name.lower()
+
+    # extract version numbers
+    ver = rx_not_ver.sub('', name).split('_')
+    ver = [int(n) for n in ver if n]
+
+    for t, num in VERSION_TYPES:
+        if t in name:
+            # example:
+            #  REL_10_RC1 => (10, -1, 1)
+            #  REL_9_6_STABLE => (9, 6, 'inf')
+            _, _, s = name.rpartition(t)
+            if s.isdigit():
+                ver.pop()  # see ver extraction
+                ver.append(num)
+                ver.append(int(s))
+            else:
+                ver.append(num)
+
+    return tuple(ver)
+
+
+class SortRefByVersion:
+    """
+    Sort key: version numbers of a ref (forks share lots of tags,
+    so versions are cached by name).
+    """
+
+    def __call__(self, ref):
+        return ref_version(ref.name)
 
 
-@total_ordering
 class SortRefBySimilarity:
+    """
+    Sort key: similarity of a ref's trigrams to those of a query.
+    """
+
     @staticmethod
     def ngram(text, n=3):
         ngrams = (text[i:i + n] for i in range(0, len(text) - n + 1))
@@ -59,26 +122,188 @@ class SortRefBySimilarity:
 
     @staticmethod
     def similarity(ng1, ng2):
-        return len(ng1 & ng2) / float(len(ng1 | ng2))
+        union = len(ng1 | ng2)
+        return len(ng1 & ng2) / float(union) if union else 0.0
 
-    def __init__(self, ref, name_ngram):
-        ng1 = self.ngram(ref.name)
-        ng2 = name_ngram
+    def __init__(self, query):
+        # pre-calculated for better performance
+        self.query_ngram = self.ngram(query)
+        self.scores = {}
 
-        self.similarity = self.similarity(ng1, ng2)
-        self.ref = ref
+    def __call__(self, ref):
+        score = self.scores.get(ref.name)
+        if score is None:
+            score = self.similarity(self.ngram(ref.name), self.query_ngram)
+            self.scores[ref.name] = score
 
-    def __eq__(self, other):
-        return self.similarity == other.similarity
-
-    def __lt__(self, other):
-        return self.similarity < other.similarity
+        return score
 
 
 class GitRef:
-    def __init__(self, repo, name):
+    def __init__(self, repo, name, commit=None):
         self.repo = repo
         self.name = name
+        self.commit = commit
+
+
+class RefIndex:
+    """
+    In-memory trigram index of all branches and tags of a repo.
+    """
+
+    rx_glob = re.compile(r'\*|\?|\[[^\]]*\]')
+
+    def __init__(self, repo, refs, updated=0):
+        self.repo = repo
+        self.refs = refs  # [(refname, commit), ...]
+        self.updated = updated
+
+        self.commits = dict(refs)
+
+        self.ngrams = {}
+        for i, (refname, _) in enumerate(refs):
+            for ng in SortRefBySimilarity.ngram(refname):
+                self.ngrams.setdefault(ng, set()).add(i)
+
+    @staticmethod
+    def load(path):
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+
+            refs = [tuple(r) for r in data['refs']]
+            return RefIndex(data['repo'], refs, data['updated'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def parse(repo, ls_remote_out):
+        refs = [tuple(reversed(r.split())) for r in ls_remote_out.splitlines()]
+        return RefIndex(repo, refs, updated=time.time())
+
+    def branch_hash(self, branch):
+        # stale cache is no good
+        if self.updated >= RUN_STARTED:
+            return self.commits.get(f'refs/heads/{branch}')
+
+    def save(self, path):
+        data = {
+            'repo': self.repo,
+            'updated': self.updated,
+            'refs': self.refs,
+        }
+
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(f'{path}.tmp', path)
+
+    def _candidates(self, pattern):
+        # every literal part of a pattern must be present in refname
+        ngrams = set()
+        for s in self.rx_glob.split(pattern):
+            ngrams |= SortRefBySimilarity.ngram(s)
+
+        if not ngrams:
+            return range(len(self.refs))
+
+        postings = (self.ngrams.get(ng, set()) for ng in ngrams)
+        return set.intersection(*postings)
+
+    def find(self, patterns):
+        found = set()
+
+        for pattern in patterns:
+            for i in self._candidates(pattern):
+                # same rules as in 'git ls-remote <repo> <patterns>'
+                if fnmatchcase(f'/{self.refs[i][0]}', f'*/{pattern}'):
+                    found.add(i)
+
+        return [
+            GitRef(self.repo, os.path.basename(refname), commit)
+            for refname, commit in (self.refs[i] for i in sorted(found))
+        ]
+
+
+class GitMirror:
+    """
+    Local bare mirror of a remote repo shared by all work dirs.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.path = os.path.join(MIRRORS_DIR, f'{repo_id(url)}.git')
+        self.stamp_file = os.path.join(self.path, 'norsu_updated')
+
+    @staticmethod
+    def from_path(path):
+        if os.path.dirname(path) == MIRRORS_DIR:
+            url = read_origin_url(path)
+            if not url:
+                args = ['git', 'config', '--get', 'remote.origin.url']
+                url = execute(args, cwd=path).strip()
+
+            return GitMirror(url)
+
+    @property
+    def updated_at(self):
+        if os.path.exists(self.stamp_file):
+            return os.path.getmtime(self.stamp_file)
+        return 0
+
+    def _update_steps(self):
+        """
+        Commands which bring the mirror up to date (none if it's fresh).
+        """
+
+        if not os.path.exists(self.path):
+            return [
+                (['git', 'clone', '--mirror', self.url, self.path],
+                 {'output': ExecOutput.Devnull}),
+
+                # work dirs borrow objects, never drop them
+                (['git', 'config', 'gc.pruneExpire', 'never'],
+                 {'cwd': self.path}),
+            ]
+
+        if self.updated_at < RUN_STARTED:
+            return [
+                (['git', 'fetch', 'origin'],
+                 {'cwd': self.path, 'output': ExecOutput.Devnull}),
+            ]
+
+        return []  # already fresh
+
+    def update(self):
+        """
+        Create or refresh the mirror (at most once per command).
+        """
+
+        os.makedirs(MIRRORS_DIR, exist_ok=True)
+
+        with file_lock(f'{self.path}.lock'):
+            steps = self._update_steps()
+            for args, kwargs in steps:
+                execute(args, **kwargs)
+
+            if steps:
+                with open(self.stamp_file, 'w'):
+                    pass
+
+    async def update_async(self):
+        """
+        Same as update(), but lets other coroutines run meanwhile.
+        """
+
+        os.makedirs(MIRRORS_DIR, exist_ok=True)
+
+        async with async_file_lock(f'{self.path}.lock'):
+            steps = self._update_steps()
+            for args, kwargs in steps:
+                await execute_async(args, **kwargs)
+
+            if steps:
+                with open(self.stamp_file, 'w'):
+                    pass
 
 
 class GitRepo:
@@ -86,54 +311,375 @@ class GitRepo:
         self.work_dir = work_dir
         self.url = url
 
+        # memoized state, see invalidate()
+        self._state = {}
+
+    def _memoize(self, key, func):
+        if key not in self._state:
+            self._state[key] = func()
+        return self._state[key]
+
+    def invalidate(self):
+        self._state.clear()
+
+    def _read_git_file(self, *path):
+        try:
+            with open(os.path.join(self.work_dir, '.git', *path), 'r') as f:
+                return f.read()
+        except (OSError, ValueError):
+            return None  # not a file or doesn't exist
+
+    def _packed_refs(self):
+        def read():
+            refs = {}  # refname => (hash, peeled hash)
+            last = None
+
+            for ln in (self._read_git_file('packed-refs') or '').splitlines():
+                if ln.startswith('#'):
+                    continue
+                elif ln.startswith('^') and last:
+                    refs[last] = (refs[last][0], ln[1:])
+                else:
+                    commit, _, last = ln.partition(' ')
+                    refs[last] = (commit, None)
+
+            return refs
+
+        return self._memoize('packed_refs', read)
+
+    def _resolve_ref(self, refname):
+        commit = self._read_git_file(refname)
+        if commit:
+            return commit.strip()
+
+        commit, _ = self._packed_refs().get(refname, (None, None))
+        return commit
+
+    def _head(self):
+        # (symbolic ref, commit) or None if we can't read .git
+        def read():
+            head = self._read_git_file('HEAD')
+            if not head:
+                return None
+
+            head = head.strip()
+            if head.startswith('ref: '):
+                refname = head[len('ref: '):]
+                return refname, self._resolve_ref(refname)
+
+            return None, head
+
+        return self._memoize('head', read)
+
     @property
     def branch(self):
-        args = ['git', 'symbolic-ref', '--short', 'HEAD']
-        out = execute(args, cwd=self.work_dir, error=False)
-        if out:
-            return out.strip()
+        def read():
+            head = self._head()
+            if head:
+                refname, _ = head
+                if refname and refname.startswith('refs/heads/'):
+                    return refname[len('refs/heads/'):]
+                return None
+
+            args = ['git', 'symbolic-ref', '--short', 'HEAD']
+            out = execute(args, cwd=self.work_dir, error=False)
+            if out:
+                return out.strip()
+
+        return self._memoize('branch', read)
 
     @property
     def tag(self):
-        args = ['git', 'tag', '--points-at', 'HEAD']
-        out = execute(args, cwd=self.work_dir, error=False)
-        if out:
-            return out.strip()
+        def read():
+            tags_dir = os.path.join(self.work_dir, '.git', 'refs', 'tags')
+
+            # NOTE: loose annotated tags can't be peeled without git
+            loose_tags = os.path.isdir(tags_dir) and os.listdir(tags_dir)
+
+            if self._head() and not loose_tags:
+                commit = self.hash
+                tags = sorted(
+                    refname[len('refs/tags/'):]
+                    for refname, (h, peeled) in self._packed_refs().items()
+                    if refname.startswith('refs/tags/') and
+                    (peeled or h) == commit)
+
+                return '\n'.join(tags) or None
+
+            args = ['git', 'tag', '--points-at', 'HEAD']
+            out = execute(args, cwd=self.work_dir, error=False)
+            if out:
+                return out.strip()
+
+        return self._memoize('tag', read)
 
     @property
     def hash(self):
-        args = ['git', 'rev-parse', 'HEAD']
-        return execute(args, cwd=self.work_dir).strip()
-
-    def clone(self, url=None, branch='master', depth=1):
-        args = [
-            'git',
-            'clone',
-            '--branch',
-            branch,
-            '--depth',
-            str(depth),
-            url or self.url,
-            self.work_dir,
-        ]
+        def read():
+            head = self._head()
+            if head and head[1]:
+                return head[1]
+
+            args = ['git', 'rev-parse', 'HEAD']
+            return execute(args, cwd=self.work_dir).strip()
+
+        return self._memoize('hash', read)
+
+    @property
+    def remote_url(self):
+        def read():
+            url = read_origin_url(os.path.join(self.work_dir, '.git'))
+            if url:
+                return url
+
+            args = ['git', 'config', '--get', 'remote.origin.url']
+            out = execute(args, cwd=self.work_dir, error=False)
+            if out:
+                return out.strip()
+
+        return self._memoize('remote_url', read)
+
+    def clone(self, url=None, branch='master'):
+        url = url or self.url
+
+        if CONFIG['repos']['mirror']:
+            mirror = GitMirror(url)
+            mirror.update()
+
+            # borrow objects from the mirror
+            args = ['git', 'clone', '--shared', mirror.path]
+        else:
+            strategy = CONFIG['repos']['clone']
+            if strategy not in CLONE_STRATEGIES:
+                raise LogicError(f'Unknown clone strategy {strategy}, '
+                                 'check repos.clone')
+
+            args = ['git', 'clone', *CLONE_STRATEGIES[strategy], url]
+
+        args += ['--branch', branch, self.work_dir]
         execute(args, output=ExecOutput.Devnull)
+        self.invalidate()
 
     def pull(self, remote='origin', branch=None):
+        # refresh the mirror we've been cloned from
+        mirror = GitMirror.from_path(self.remote_url or '')
+        if mirror:
+            mirror.update()
+
         args = ['git', 'pull', remote, branch or self.branch]
         execute(args, cwd=self.work_dir, output=ExecOutput.Devnull)
+        self.invalidate()
+
+    @property
+    def upstream_url(self):
+        """
+        URL of the repo we've been cloned from (bypassing mirrors).
+        """
+
+        mirror = GitMirror.from_path(self.remote_url or '')
+        return mirror.url if mirror else self.remote_url
+
+    async def fetch_async(self, remote='origin', branches=()):
+        """
+        Fetch latest changes (of some branches) without merging them.
+        """
+
+        # refresh the mirror we've been cloned from
+        mirror = GitMirror.from_path(self.remote_url or '')
+        if mirror:
+            await mirror.update_async()
+
+        args = ['git', 'fetch', remote, *branches]
+        await execute_async(args,
+                            cwd=self.work_dir,
+                            output=ExecOutput.Devnull)
+        self.invalidate()
+
+    def remote_branch_hash(self):
+        """
+        Get hash of current branch in the upstream repo (or None), using
+        a single ls-remote per repo per command (see load_refs).
+        """
+
+        url = self.upstream_url
+        branch = self.branch
+        if not url or not branch:
+            return None
+
+        try:
+            return load_refs(url, refresh=True).branch_hash(branch)
+        except ProcessError:
+            return None
+
+    async def remote_branch_hash_async(self):
+        url = self.upstream_url
+        branch = self.branch
+        if not url or not branch:
+            return None
+
+        try:
+            index = await load_refs_async(url, refresh=True)
+            return index.branch_hash(branch)
+        except ProcessError:
+            return None
+
+    async def merge_async(self, ref='FETCH_HEAD'):
+        args = ['git', 'merge', '--ff-only', ref]
+
+        try:
+            await execute_async(args,
+                                cwd=self.work_dir,
+                                output=ExecOutput.Devnull)
+        except ProcessError:
+            # there are local commits, merge just like 'git pull' does
+            args = ['git', 'merge', '--no-edit', ref]
+            await execute_async(args, cwd=self.work_dir)
+        finally:
+            self.invalidate()
+
+    @property
+    def is_shallow(self):
+        return os.path.exists(os.path.join(self.work_dir, '.git', 'shallow'))
+
+    def _has_commit(self, commit):
+        args = ['git', 'cat-file', '-e', f'{commit}^{{commit}}']
+
+        try:
+            execute(args, cwd=self.work_dir)
+            return True
+        except ProcessError:
+            return False
+
+    async def _has_commit_async(self, commit):
+        args = ['git', 'cat-file', '-e', f'{commit}^{{commit}}']
+
+        try:
+            await execute_async(args, cwd=self.work_dir)
+            return True
+        except ProcessError:
+            return False
+
+    def _merge_base(self, commit1, commit2):
+        args = ['git', 'merge-base', commit1, commit2]
+
+        try:
+            execute(args, cwd=self.work_dir)
+            return True
+        except ProcessError:
+            return False  # unknown commit or beyond shallow history
+
+    async def _merge_base_async(self, commit1, commit2):
+        args = ['git', 'merge-base', commit1, commit2]
+
+        try:
+            await execute_async(args, cwd=self.work_dir)
+            return True
+        except ProcessError:
+            return False  # unknown commit or beyond shallow history
+
+    def deepen(self, commit1, commit2):
+        """
+        Fetch just enough of shallow history to connect both commits.
+        """
+
+        if not self.is_shallow:
+            return
+
+        try:
+            for commit in (commit1, commit2):
+                if not self._has_commit(commit):
+                    # NOTE: fails if commit is no longer in remote's history
+                    args = ['git', 'fetch', '--depth=1', 'origin', commit]
+                    execute(args,
+                            cwd=self.work_dir,
+                            output=ExecOutput.Devnull)
+
+            depth = DEEPEN_MIN
+            while depth <= DEEPEN_MAX and self.is_shallow and \
+                    not self._merge_base(commit1, commit2):
+                boundary = self._read_git_file('shallow')
+
+                args = ['git', 'fetch', f'--deepen={depth}']
+                execute(args, cwd=self.work_dir, output=ExecOutput.Devnull)
+                depth *= 2
+
+                # e.g. unrelated histories, we've reached their roots
+                if self._read_git_file('shallow') == boundary:
+                    break
+        except ProcessError:
+            pass  # e.g. a force-pushed branch, no way to count commits
+        finally:
+            self.invalidate()
+
+    async def deepen_async(self, commit1, commit2):
+        """
+        Same as deepen(), but lets other coroutines run meanwhile.
+        """
+
+        if not self.is_shallow:
+            return
+
+        try:
+            for commit in (commit1, commit2):
+                if not await self._has_commit_async(commit):
+                    args = ['git', 'fetch', '--depth=1', 'origin', commit]
+                    await execute_async(args,
+                                        cwd=self.work_dir,
+                                        output=ExecOutput.Devnull)
+
+            depth = DEEPEN_MIN
+            while depth <= DEEPEN_MAX and self.is_shallow and \
+                    not await self._merge_base_async(commit1, commit2):
+                boundary = self._read_git_file('shallow')
+
+                args = ['git', 'fetch', f'--deepen={depth}']
+                await execute_async(args,
+                                    cwd=self.work_dir,
+                                    output=ExecOutput.Devnull)
+                depth *= 2
+
+                if self._read_git_file('shallow') == boundary:
+                    break
+        except ProcessError:
+            pass
+        finally:
+            self.invalidate()
+
+    @staticmethod
+    def _distance_args(commit1, commit2):
+        return ['git', 'rev-list', f'{commit1}..{commit2}', '--count']
 
     def distance(self, commit1, commit2):
-        args = [
-            'git',
-            'rev-list',
-            f'{commit1}..{commit2}',
-            '--count',
-        ]
+        # rev-list can't count past the boundary of a shallow clone
+        self.deepen(commit1, commit2)
+
+        args = self._distance_args(commit1, commit2)
 
         try:
-            # mute possible cast errors
-            return int(execute(args, cwd=self.work_dir).strip())
-        except ValueError:
+            # mute possible cast errors (or a commit that's gone)
+            out = execute(args, cwd=self.work_dir)
+            return int(out.strip())
+        except (ValueError, ProcessError):
+            pass
+
+    async def distance_async(self, commit1, commit2):
+        await self.deepen_async(commit1, commit2)
+
+        args = self._distance_args(commit1, commit2)
+
+        try:
+            out = await execute_async(args, cwd=self.work_dir)
+            return int(out.strip())
+        except (ValueError, ProcessError):
+            pass
+
+    def changed_files(self, commit1, commit2):
+        # NOTE: rename detection would fetch blobs of a blobless clone
+        args = ['git', 'diff', '--name-only', '--no-renames', commit1, commit2]
+
+        try:
+            return execute(args, cwd=self.work_dir).splitlines()
+        except ProcessError:
             pass
 
     def add_excludes(self, pattern):
@@ -145,23 +691,162 @@ class GitRepo:
                 f.write(pattern)
 
 
-def find_relevant_refs(repos, patterns):
-    refs = []
+# indices of repos loaded by this process
+_ref_indices = {}
+
 
-    for repo in repos:
-        args = ['git', 'ls-remote', '--heads', '--tags', repo]
-        args += patterns  # search patterns
+def _refs_cache(repo, refresh):
+    """
+    Return (index loaded by this process or None, path of cached index,
+    least acceptable time of update).
+    """
 
-        out = execute(args)
+    if refresh:
+        min_updated = RUN_STARTED
+    else:
+        min_updated = time.time() - CONFIG['repos']['cache_ttl']
+
+    index = _ref_indices.get(repo)
+    if index and index.updated < min_updated:
+        index = None
+
+    os.makedirs(REFS_DIR, exist_ok=True)
+    path = os.path.join(REFS_DIR, f'{repo_id(repo)}.json')
+
+    return index, path, min_updated
+
+
+def _ls_remote_args(repo):
+    args = ['git', 'ls-remote', '--heads', '--tags', '--refs', repo]
+
+    # never wait for credentials
+    env = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+
+    return args, {'env': env, 'timeout': CONFIG['repos']['timeout']}
+
+
+def load_refs(repo, refresh=False):
+    """
+    Get a (possibly cached) index of all branches and tags of a repo.
+    If refresh is set, make sure it's been fetched during this command.
+    """
+
+    index, path, min_updated = _refs_cache(repo, refresh)
+    if index:
+        return index
+
+    with file_lock(f'{path}.lock'):
+        index = RefIndex.load(path)
+
+        if not index or index.updated < min_updated:
+            args, kwargs = _ls_remote_args(repo)
+
+            try:
+                out = execute(args, **kwargs)
+            except ProcessError as e:
+                if not index:
+                    raise
+
+                eprint(Style.yellow(f'{e}, using cached branches'))
+                return index
+
+            index = RefIndex.parse(repo, out)
+            index.save(path)
+
+    _ref_indices[repo] = index
+    return index
+
+
+async def load_refs_async(repo, refresh=False):
+    """
+    Same as load_refs(), but lets other coroutines run meanwhile.
+    """
+
+    index, path, min_updated = _refs_cache(repo, refresh)
+    if index:
+        return index
+
+    async with async_file_lock(f'{path}.lock'):
+        index = RefIndex.load(path)
+
+        if not index or index.updated < min_updated:
+            args, kwargs = _ls_remote_args(repo)
+
+            try:
+                out = await execute_async(args, **kwargs)
+            except ProcessError as e:
+                if not index:
+                    raise
+
+                eprint(Style.yellow(f'{e}, using cached branches'))
+                return index
+
+            index = RefIndex.parse(repo, out)
+            index.save(path)
+
+    _ref_indices[repo] = index
+    return index
+
+
+def _match_refs(repos, indices, patterns):
+    refs = []
+    errors = []
+
+    # NOTE: repos are still processed in order of priority
+    for repo, index in zip(repos, indices):
+        if isinstance(index, ProcessError):
+            eprint(Style.yellow(f'Skipping repo {repo}: {index}'))
+            errors.append(index)
+            continue
 
         # list of matching branches and tags
-        refs += [
-            GitRef(repo, os.path.basename(r.split()[-1]))
-            for r in out.splitlines()
-        ]
+        refs += index.find(patterns)
 
         # should we stop after 1st match?
         if refs and CONFIG['repos']['first_match']:
             break
 
+    # every repo has failed
+    if not refs and errors and len(errors) == len(repos):
+        raise errors[0]
+
+    return refs
+
+
+def find_relevant_refs(repos, patterns, refresh=False):
+    def load(repo):
+        try:
+            return load_refs(repo, refresh)
+        except ProcessError as e:
+            return e
+
+    # query all repos at once, a slow one won't stall the rest
+    with ThreadPoolExecutor(max_workers=max(len(repos), 1)) as pool:
+        indices = list(pool.map(load, repos))
+
+    refs = _match_refs(repos, indices, patterns)
+
+    # maybe the cache is just too old?
+    if not refs and not refresh:
+        return find_relevant_refs(repos, patterns, refresh=True)
+
+    return refs
+
+
+async def find_relevant_refs_async(repos, patterns, refresh=False):
+    indices = await gather_limited((load_refs_async(r, refresh) for r in repos),
+                                   limit=max(len(repos), 1))
+
+    for index in indices:
+        if isinstance(index, Exception) and \
+                not isinstance(index, ProcessError):
+            raise index
+
+    refs = _match_refs(repos, indices, patterns)
+
+    if not refs and not refresh:
+        return await find_relevant_refs_async(repos,
+                                              patterns,
+                                              refresh=True)
+
     return refs
@@ -1,33 +1,67 @@
+import asyncio
+import hashlib
+import heapq
+import json
 import os
 import re
 import shlex
 import sys
 import multiprocessing
 
-from contextlib import contextmanager, redirect_stdout
-from enum import Enum
-from shutil import rmtree
-from testgres import get_new_node, configure_testgres
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager, redirect_stdout
+from shutil import copytree, rmtree
 
-from norsu.config import NORSU_DIR, WORK_DIR, CONFIG, TOOL_MAKE
+from norsu.aio import async_file_lock
+from norsu.artifacts import ArtifactStore
+from norsu.ccache import ccache_env, read_stats_log
+from norsu.config import WORK_DIR, CONFIG, TOOL_MAKE
+from norsu.dedupe import dedupe, installed_dirs
 from norsu.exceptions import LogicError, ProcessError
-from norsu.execute import ExecOutput, execute
-from norsu.extension import Extension
-from norsu.terminal import Style
+from norsu.execute import ExecOutput, execute, execute_async
+from norsu.jobserver import JobServer
+from norsu.stats import BuildStats
+from norsu.targets import InstanceName, InstanceNameType, target_dir
+from norsu.terminal import Style, progress_line
+from norsu.trash import empty_trash, move_to_trash
 
 from norsu.git import (
     GitRepo,
     SortRefBySimilarity,
     SortRefByVersion,
     find_relevant_refs,
+    repo_id,
 )
 
 from norsu.utils import (
     eprint,
+    file_lock,
+    format_size,
+    limit_lines,
     path_exists,
+    rotate_file,
 )
 
 
+# source trees shared by out-of-tree (VPATH) builds
+SOURCES_DIR = os.path.join(WORK_DIR, '.sources')
+
+# locks of source trees (see source_lock)
+LOCKS_DIR = os.path.join(WORK_DIR, '.locks')
+
+# options of initdb for temp instances (see run_temp)
+INITDB_OPTIONS = ['-N']
+
+
+# changes in these files require a fresh ./configure
+CONFIGURE_FILES = {
+    'configure',
+    'configure.ac',
+    'configure.in',
+    'src/include/pg_config.h.in',
+}
+
+
 def step(*args):
     print(Style.green('\t=>'), *args)
 
@@ -47,66 +81,43 @@ def write_commit_file(path, value):
         f.write(value or '')
 
 
-def sort_refs(refs, name):
-    # key function for sort
-    def to_key(x):
-        if name.type == InstanceNameType.Version:
-            return SortRefByVersion(x)
-        else:
-            # pre-calculated for better performance
-            name_ngram = SortRefBySimilarity.ngram(name.query)
-            return SortRefBySimilarity(x, name_ngram)
-
-    return sorted(refs, reverse=True, key=to_key)
-
-
-class InstanceNameType(Enum):
-    Version = 1
-    Branch = 2
+def source_lock(src_dir):
+    # NOTE: WORK_DIR must contain nothing but work dirs
+    os.makedirs(LOCKS_DIR, exist_ok=True)
+    name = os.path.relpath(src_dir, WORK_DIR).replace(os.sep, '%')
+    return os.path.join(LOCKS_DIR, f'{name}.lock')
 
 
-class InstanceName:
-    rx_is_ver = re.compile(r'\d+([._]\d+)*')
-    rx_sep = re.compile(r'(\.|_)')
+def parse_configure_options(pg_config_out):
+    if pg_config_out:
+        options = shlex.split(pg_config_out)
+        return [x for x in options if not x.startswith('--prefix')]
 
-    @staticmethod
-    def _check_str(s):
-        pred1 = len(s.strip()) > 0
-        pred2 = any(c.isalnum() for c in s)
 
-        if not (pred1 and pred2):
-            raise LogicError('Bad identifier: {s}')
+def build_jobs():
+    jobs = int(CONFIG['build']['jobs'])
+    if jobs == 0:
+        jobs = multiprocessing.cpu_count()
 
-        return s
+    return jobs
 
-    def __init__(self, name, query=None):
-        self.value = self._check_str(name)
-        self.query = self._check_str(query or name)
 
-        if self.rx_is_ver.match(self.query):
-            self.type = InstanceNameType.Version
-        else:
-            self.type = InstanceNameType.Branch
-
-    def to_patterns(self):
-        pattern = self.query
-        result = [pattern]
+def sort_refs(refs, name, limit=None):
+    """
+    Sort refs by relevance to name, best first. Given a limit,
+    select only top refs, which is cheaper for lots of them.
+    """
 
-        if self.type == InstanceNameType.Version:
-            # replace version separators with a pattern
-            pattern = self.rx_sep.sub(lambda m: '[._]', pattern)
+    if name.type == InstanceNameType.Version:
+        key = SortRefByVersion()
+    else:
+        key = SortRefBySimilarity(name.query)
 
-            result.extend([
-                f'REL_{pattern}*',
-                f'REL{pattern}*',
-            ])
-        else:
-            result.append(f'*{pattern}*')
-
-        return result
+    if limit is not None:
+        # NOTE: same as sorted(...)[:limit], ties included
+        return heapq.nlargest(limit, refs, key=key)
 
-    def __str__(self):
-        return self.value
+    return sorted(refs, reverse=True, key=key)
 
 
 class Instance:
@@ -116,9 +127,12 @@ class Instance:
         else:
             self.name = InstanceName(name)
 
-        self.main_dir = os.path.join(NORSU_DIR, str(name))
+        self.main_dir = target_dir(name)
         self.work_dir = os.path.join(WORK_DIR, str(name))
-        self.git = GitRepo(work_dir=self.work_dir)
+        self._git = None
+
+        # points to shared sources in case of a VPATH build
+        self.source_file = os.path.join(self.work_dir, '.norsu_source')
 
         # various utility files
         self.ignore_file = os.path.join(self.main_dir, '.norsu_ignore')
@@ -126,15 +140,46 @@ class Instance:
         # store commit hashes (build + install)
         self.installed_commit_file = os.path.join(self.main_dir,
                                                   '.norsu_build')
+
+        # pristine data dirs for temp instances
+        self.initdb_dir = os.path.join(self.work_dir, '.norsu_initdb')
+
+        # properties of installed build (see status)
+        self.metadata_file = os.path.join(self.main_dir, '.norsu_meta')
         self.built_commit_file = os.path.join(self.work_dir, '.norsu_build')
 
+        # key of artifact the installed build has been restored from
+        self.artifact_file = os.path.join(self.work_dir, '.norsu_artifact')
+
+        # compiler cache statistics of the latest build
+        self.ccache_log_file = os.path.join(self.work_dir, '.norsu_ccache.log')
+        self.ccache_stats_file = os.path.join(self.work_dir, '.norsu_ccache')
+
+        # timings of build phases (history of builds)
+        self.build_stats_file = os.path.join(self.main_dir, '.norsu_stats')
+        self.build_stats = BuildStats()
+
+        # full output of configure, make etc
+        self.logs_dir = os.path.join(self.work_dir, '.norsu_logs')
+
     @property
     def ignore(self):
         return os.path.exists(self.ignore_file)
 
+    @property
+    def src_dir(self):
+        return read_commit_file(self.source_file) or self.work_dir
+
+    @property
+    def git(self):
+        src_dir = self.src_dir
+        if not self._git or self._git.work_dir != src_dir:
+            self._git = GitRepo(work_dir=src_dir)
+        return self._git
+
     @property
     def actual_commit_hash(self):
-        if os.path.exists(self.work_dir):
+        if os.path.exists(self.src_dir):
             return self.git.hash
 
     @property
@@ -153,6 +198,25 @@ class Instance:
     def built_commit_hash(self, value):
         write_commit_file(self.built_commit_file, value)
 
+    @property
+    def restored_artifact(self):
+        return read_commit_file(self.artifact_file) or None
+
+    @restored_artifact.setter
+    def restored_artifact(self, value):
+        write_commit_file(self.artifact_file, value)
+
+    @property
+    def ccache_stats(self):
+        stats = read_commit_file(self.ccache_stats_file)
+        if stats:
+            hits, misses = map(int, stats.split())
+            return hits, misses
+
+    @ccache_stats.setter
+    def ccache_stats(self, value):
+        write_commit_file(self.ccache_stats_file, '{} {}'.format(*value))
+
     @property
     def requires_reinstall(self):
         # NOTE: remember that re-build != re-install!
@@ -169,6 +233,16 @@ class Instance:
 
         return bc != ac or not bc or not ac
 
+    @property
+    def tracks_dependencies(self):
+        # was it configured with --enable-depend?
+        makefile = os.path.join(self.work_dir, 'src', 'Makefile.global')
+        if os.path.exists(makefile):
+            with open(makefile, 'r') as f:
+                return any(re.match(r'autodepend\s*=\s*yes', ln) for ln in f)
+
+        return False
+
     def get_bin_path(self, name):
         return os.path.join(self.main_dir, 'bin', name)
 
@@ -177,33 +251,27 @@ class Instance:
         if os.path.exists(pg_config):
             return execute([pg_config] + params)
 
-    def status(self):
-        postgres = os.path.join(self.main_dir, 'bin', 'postgres')
-
-        if os.path.exists(postgres):
-            if self.requires_reinstall:
-                status = Style.yellow('Installed (out of date)')
-            else:
-                status = Style.green('Installed')
-        else:
-            status = Style.red('Not installed')
+    async def pg_config_async(self, params=None):
+        pg_config = self.get_bin_path('pg_config')
+        if os.path.exists(pg_config):
+            return await execute_async([pg_config] + params)
 
-        line('Status:', status)
-        line('Main dir:', path_exists(self.main_dir))
-        line('Work dir:', path_exists(self.work_dir))
+    def _make_metadata(self, version, configure):
+        meta = {
+            'version': None,
+            'configure': None,
+            'branch': None,
+            'commit': self.installed_commit_hash,
+            'valgrind': False,
+        }
 
-        if os.path.exists(self.work_dir):
-            branch = self.git.branch or self.git.tag
-            if branch:
-                line('Branch:', branch)
+        if os.path.exists(self.src_dir):
+            meta['branch'] = self.git.branch or self.git.tag
 
-        pg_config_out = self.pg_config(['--version'])
-        if pg_config_out:
-            line('Version:', pg_config_out.strip())
+        if version:
+            meta['version'] = version.strip()
 
-        commit = self.installed_commit_hash
-        if commit:
-            line('Commit:', commit)
+        meta['configure'] = parse_configure_options(configure)
 
         pg_config_manual = os.path.join(self.main_dir, 'include',
                                         'pg_config_manual.h')
@@ -213,11 +281,199 @@ class Instance:
                     if ln.startswith('#define MEMORY_CONTEXT_CHECKING'):
                         break  # too late
                     if ln.startswith('#define USE_VALGRIND'):
-                        line('Valgrind:', 'Enabled')
+                        meta['valgrind'] = True
                         break  # OK
 
+        return meta
+
+    def _probe_metadata(self):
+        return self._make_metadata(self.pg_config(['--version']),
+                                   self.pg_config(['--configure']))
+
+    async def _probe_metadata_async(self):
+        version, configure = await asyncio.gather(
+            self.pg_config_async(['--version']),
+            self.pg_config_async(['--configure']))
+
+        return self._make_metadata(version, configure)
+
+    def _read_metadata(self):
+        try:
+            with open(self.metadata_file, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # is it still relevant?
+        commit = self.installed_commit_hash
+        if commit and meta.get('commit') == commit:
+            return meta
+
+    def _write_metadata(self, meta):
+        with open(self.metadata_file, 'w') as f:
+            json.dump(meta, f)
+
+        return meta
+
+    def update_metadata(self):
+        return self._write_metadata(self._probe_metadata())
+
+    async def update_metadata_async(self):
+        return self._write_metadata(await self._probe_metadata_async())
+
+    @property
+    def metadata(self):
+        meta = self._read_metadata()
+        if meta:
+            return meta
+
+        # cache metadata of installed builds
+        if self.installed_commit_hash:
+            return self.update_metadata()
+
+        return self._probe_metadata()
+
+    async def metadata_async(self):
+        meta = self._read_metadata()
+        if meta:
+            return meta
+
+        if self.installed_commit_hash:
+            return await self.update_metadata_async()
+
+        return await self._probe_metadata_async()
+
+    def info(self):
+        return self._make_info(self.metadata)
+
+    async def info_async(self):
+        return self._make_info(await self.metadata_async())
+
+    def _make_info(self, meta):
+        postgres = os.path.join(self.main_dir, 'bin', 'postgres')
+
+        if os.path.exists(postgres):
+            if self.requires_reinstall:
+                status = 'Installed (out of date)'
+            else:
+                status = 'Installed'
+        else:
+            status = 'Not installed'
+
+        result = {
+            'name': str(self.name),
+            'status': status,
+            'main_dir': path_exists(self.main_dir),
+            'work_dir': path_exists(self.work_dir),
+            'src_dir': path_exists(self.src_dir),
+            'branch': meta['branch'],
+            'version': meta['version'],
+            'commit': meta['commit'],
+            'valgrind': meta['valgrind'],
+            'configure': meta['configure'] or
+            CONFIG['build']['configure_options'],
+            'ccache': None,
+        }
+
+        ccache_stats = self.ccache_stats
+        if ccache_stats:
+            hits, misses = ccache_stats
+            result['ccache'] = {'hits': hits, 'misses': misses}
+
+        return result
+
+    def status(self, info=None):
+        info = info or self.info()
+
+        styles = {
+            'Installed': Style.green,
+            'Installed (out of date)': Style.yellow,
+            'Not installed': Style.red,
+        }
+
+        line('Status:', styles[info['status']](info['status']))
+        line('Main dir:', info['main_dir'])
+        line('Work dir:', info['work_dir'])
+
+        if self.src_dir != self.work_dir:
+            line('Source dir:', info['src_dir'])
+
+        if info['branch']:
+            line('Branch:', info['branch'])
+
+        if info['version']:
+            line('Version:', info['version'])
+
+        if info['commit']:
+            line('Commit:', info['commit'])
+
+        if info['valgrind']:
+            line('Valgrind:', 'Enabled')
+
+        line('CONFIGURE:', info['configure'])
+
+        if info['ccache']:
+            hits = info['ccache']['hits']
+            misses = info['ccache']['misses']
+            total = max(hits + misses, 1)
+            line('Ccache:', f'{hits} hits, {misses} misses '
+                 f'({hits / total:.0%} hit rate)')
+
+    def initdb_template(self):
+        """
+        Get a data dir made by initdb for the installed build, if possible.
+        """
+
+        commit = self.installed_commit_hash
+        if not commit or not os.path.exists(self.work_dir):
+            return None
+
+        # NOTE: e.g. --with-blocksize changes the format of data dir
         configure = self._configure_options()
-        line('CONFIGURE:', configure)
+        key = json.dumps([commit, configure, INITDB_OPTIONS]).encode('utf8')
+        key = hashlib.sha1(key).hexdigest()[:12]
+        template = os.path.join(self.initdb_dir, key)
+
+        with file_lock(f'{self.initdb_dir}.lock'):
+            if not os.path.exists(template):
+                # templates of previous builds are useless now
+                rmtree(path=self.initdb_dir, ignore_errors=True)
+
+                args = [
+                    self.get_bin_path('initdb'),
+                    '-D',
+                    f'{template}.tmp',
+                    *INITDB_OPTIONS,
+                ]
+                execute(args)
+
+                os.rename(f'{template}.tmp', template)
+
+        return template
+
+    async def pull_async(self):
+        """
+        Pull latest changes of current branch (no clone, no output).
+        Return (old commit, new commit, distance or None if unknown).
+        """
+
+        # sources might be shared
+        async with async_file_lock(source_lock(self.src_dir)):
+            old_commit = self.git.hash
+
+            await self.git.fetch_async(branches=[self.git.branch])
+            await self.git.merge_async()
+
+            new_commit = self.git.hash
+
+            # we've pulled anyway, no need to fail here
+            try:
+                distance = await self.git.distance_async(old_commit,
+                                                         new_commit)
+            except (OSError, ProcessError):
+                distance = None
+
+            return old_commit, new_commit, distance
 
     def pull(self):
         if os.path.exists(self.main_dir) and not os.path.exists(self.work_dir):
@@ -225,7 +481,11 @@ class Instance:
         else:
             self._maybe_git_clone_or_pull(update=True)
 
-    def install(self, configure=None, extensions=None, update=True):
+    def install(self,
+                configure=None,
+                extensions=None,
+                update=True,
+                refresh=False):
         if self.ignore:
             step(Style.yellow('Ignored due to .norsu_ignore'))
 
@@ -234,64 +494,124 @@ class Instance:
             step(Style.yellow('This is a standalone build, skipping'))
 
         else:
+            self.build_stats = BuildStats()
+
             try:
-                self._maybe_git_clone_or_pull(update)
-                self._maybe_make_distclean(configure)
-                self._maybe_configure_project(configure)
-                self._maybe_make_install(configure)
-                self._maybe_make_extensions(extensions)
+                self._maybe_git_clone_or_pull(update, refresh)
+
+                # NOTE: key must not depend on what we're about to build
+                key = self._artifact_key(configure, extensions)
+
+                if not self._maybe_restore_artifact(configure, key):
+                    restored = self.restored_artifact is not None
+
+                    self._maybe_make_distclean(configure)
+                    self._maybe_configure_project(configure,
+                                                  extensions,
+                                                  restored=restored)
+                    self._maybe_make_install(configure)
+                    self._maybe_make_extensions(extensions)
+                    self._maybe_store_artifact(key)
+
+                self._maybe_dedupe()
+
+                # keep history of builds, not pulls
+                phases = self.build_stats.phases
+                if 'install' in phases or 'restore' in phases:
+                    self.build_stats.record(
+                        self.build_stats_file,
+                        commit=self.installed_commit_hash,
+                        jobs=build_jobs(),
+                        shared_jobs=JobServer.current is not None)
             except ProcessError as e:
                 step(Style.red(str(e)))
 
                 # We'd like to print log and exit with error code
-                raise ProcessError(stderr=e.stderr)
+                raise ProcessError(stderr=e.stderr, log=e.log)
 
     def remove(self):
         for path, name in [(self.main_dir, 'main'), (self.work_dir, 'work')]:
             if os.path.exists(path):
-                rmtree(path=path, ignore_errors=True)
+                move_to_trash(path)
                 step(f'Removed directory {name}')
 
+    def _probe_configure_options(self):
+        return parse_configure_options(self.pg_config(['--configure']))
+
     def _configure_options(self):
-        pg_config_out = self.pg_config(['--configure'])
-        if pg_config_out:
-            options = shlex.split(pg_config_out)
-            return [x for x in options if not x.startswith('--prefix')]
+        meta = self._read_metadata()
+        options = meta['configure'] if meta else \
+            self._probe_configure_options()
 
-        return CONFIG['build']['configure_options']
+        return options or CONFIG['build']['configure_options']
+
+    def _build_env(self):
+        if CONFIG['build']['ccache']:
+            base_dir = os.path.commonpath([self.src_dir, self.work_dir])
+            return ccache_env(base_dir=base_dir,
+                              stats_log=self.ccache_log_file)
+
+        return dict(os.environ)
+
+    def _log_file(self, name):
+        path = os.path.join(self.logs_dir, f'{name}.log')
+        os.makedirs(self.logs_dir, exist_ok=True)
+        rotate_file(path, keep=CONFIG['build']['keep_logs'])
+        return path
+
+    def _execute_phase(self, phase, args, **kwargs):
+        """
+        Execute a build step, saving its output to a log file.
+        """
+
+        with self.build_stats.phase(phase), \
+                progress_line(f'\t=> [{phase}] ') as progress:
+            execute(args,
+                    log=self._log_file(phase),
+                    progress=progress,
+                    **kwargs)
 
     def _configure_options_are_new(self, opts):
         # operation's required if new non-trivial configure flags
         return opts is not None and opts != self._configure_options()
 
-    def _maybe_git_clone_or_pull(self, update):
-        git_repo = os.path.join(self.work_dir, '.git')
+    def _maybe_git_clone_or_pull(self, update, refresh=False):
+        git_repo = os.path.join(self.src_dir, '.git')
 
         if not os.path.exists(git_repo):
             step('No work dir, choosing repo & branch')
 
             patterns = self.name.to_patterns()
-            refs = find_relevant_refs(CONFIG['repos']['urls'], patterns)
+            refs = find_relevant_refs(CONFIG['repos']['urls'],
+                                      patterns,
+                                      refresh=refresh)
 
             if not refs:
                 raise LogicError(f'No branch found for {self.name}')
 
             # select the most relevant branch
-            ref = sort_refs(refs, self.name)[0]
+            ref = sort_refs(refs, self.name, limit=1)[0]
             step('Selected repo', Style.bold(ref.repo))
             step('Selected branch', Style.bold(ref.name))
 
-            # finally, clone repo
-            self.git.clone(url=ref.repo, branch=ref.name)
-            step('Cloned git repo to work dir')
+            if CONFIG['build']['vpath']:
+                self._share_sources(ref)
+            else:
+                # finally, clone repo
+                with self.build_stats.phase('clone'):
+                    self.git.clone(url=ref.repo, branch=ref.name)
+                step('Cloned git repo to work dir')
 
         # Are we allowed to update this instance?
         elif update:
             branch = self.git.branch
 
-            # pull latest changes
-            if branch:
-                self.git.pull()
+            # pull latest changes (sources might be shared),
+            # unless remote branch is right where we are
+            if branch and not self._is_up_to_date():
+                with file_lock(source_lock(self.src_dir)), \
+                        self.build_stats.phase('pull'):
+                    self.git.pull()
 
             # should we reinstall PG?
             if self.requires_reinstall:
@@ -300,8 +620,10 @@ class Instance:
                 # show distance between installed and fresh commits
                 installed_commit = self.installed_commit_hash
                 if installed_commit:
-                    commits = self.git.distance(installed_commit, branch)
-                    fresh_commits = f'({commits} commits)'
+                    # NOTE: branch is None for tags
+                    commits = self.git.distance(installed_commit, 'HEAD')
+                    if commits is not None:
+                        fresh_commits = f'({commits} commits)'
 
                 step('Current branch:', Style.bold(branch))
                 step('Installed build is out of date', fresh_commits)
@@ -309,10 +631,47 @@ class Instance:
         # add .norsu* to git excludes
         self.git.add_excludes('.norsu*')
 
-    def _maybe_configure_project(self, configure):
+    def _is_up_to_date(self):
+        remote_hash = self.git.remote_branch_hash()
+        return remote_hash is not None and \
+            remote_hash == self.actual_commit_hash
+
+    def _share_sources(self, ref):
+        src_dir = os.path.join(SOURCES_DIR, repo_id(ref.repo), ref.name)
+        os.makedirs(os.path.dirname(src_dir), exist_ok=True)
+
+        # other targets might want the same sources right now
+        with file_lock(source_lock(src_dir)):
+            if not os.path.exists(os.path.join(src_dir, '.git')):
+                rmtree(path=src_dir, ignore_errors=True)
+                with self.build_stats.phase('clone'):
+                    GitRepo(work_dir=src_dir).clone(url=ref.repo,
+                                                    branch=ref.name)
+                step('Cloned git repo to', src_dir)
+            else:
+                step('Using shared sources at', src_dir)
+
+        # build dir will reference the sources
+        os.makedirs(self.work_dir, exist_ok=True)
+        write_commit_file(self.source_file, src_dir)
+
+    def _maybe_configure_project(self,
+                                 configure,
+                                 extensions=None,
+                                 restored=False):
+        # a build restored from artifact cache doesn't need a configured
+        # work dir, unless we're about to build something
+        nothing_to_build = restored and extensions is None and \
+            not self._configure_options_are_new(configure) and \
+            not self.requires_reinstall
+
         makefile = os.path.join(self.work_dir, 'GNUmakefile')
-        if not os.path.exists(makefile):
-            args = ['./configure', f'--prefix={self.main_dir}']
+        if not os.path.exists(makefile) and not nothing_to_build:
+            # NOTE: path is relative for in-tree builds (i.e. ./configure)
+            src_dir = os.path.relpath(self.src_dir, self.work_dir)
+            configure_script = os.path.join(src_dir, 'configure')
+
+            args = [configure_script, f'--prefix={self.main_dir}']
 
             # NOTE: [] is a valid choice
             if configure is None:
@@ -321,27 +680,57 @@ class Instance:
             if configure:
                 args.extend(configure)
 
-            execute(args, cwd=self.work_dir)
+            self._execute_phase('configure',
+                                args,
+                                cwd=self.work_dir,
+                                env=self._build_env())
             step('Configured sources with', configure)
 
+    def _requires_clean_build(self):
+        if not self.requires_rebuild:
+            return False
+
+        built_commit = self.built_commit_hash
+        if not built_commit:
+            return True  # we don't know what's in work dir
+
+        changed = self.git.changed_files(built_commit, 'HEAD')
+        if changed is None:
+            return True  # e.g. built commit is gone
+
+        if any(f in CONFIGURE_FILES for f in changed):
+            return True
+
+        # make won't notice modified headers without dependency tracking
+        if not self.tracks_dependencies:
+            if any(f.endswith('.h') for f in changed):
+                return True
+
+        return False
+
     def _maybe_make_distclean(self, configure):
         makefile = os.path.join(self.work_dir, 'GNUmakefile')
-        new_conf_opts = self._configure_options_are_new(configure)
+        if not os.path.exists(makefile):
+            return
 
-        if os.path.exists(makefile) and \
-           (new_conf_opts or self.requires_rebuild):
+        new_conf_opts = self._configure_options_are_new(configure)
 
+        if new_conf_opts or self._requires_clean_build():
             # reset built commit hash
             self.built_commit_hash = None
 
             args = [TOOL_MAKE, 'distclean']
-            execute(args,
-                    cwd=self.work_dir,
-                    error=False,
-                    output=ExecOutput.Devnull)
+            with self.build_stats.phase('distclean'):
+                execute(args,
+                        cwd=self.work_dir,
+                        error=False,
+                        output=ExecOutput.Devnull)
 
             step('Prepared work dir for a new build')
 
+        elif self.requires_rebuild:
+            step('Sources have changed, rebuilding incrementally')
+
     def _maybe_make_install(self, configure):
         new_conf_opts = self._configure_options_are_new(configure)
 
@@ -349,48 +738,190 @@ class Instance:
             # update built commit hash
             self.built_commit_hash = self.actual_commit_hash
 
-            jobs = int(CONFIG['build']['jobs'])
-            if jobs == 0:
-                 jobs = multiprocessing.cpu_count()
+            env = self._build_env()
+
+            if JobServer.current:
+                # share job slots with concurrent builds
+                options = JobServer.current.make_options(env)
+                make_opts = []
+            else:
+                options = {'env': env}
+                make_opts = [f'-j{build_jobs()}']
+
+            # start a new stats log
+            if os.path.exists(self.ccache_log_file):
+                os.remove(self.ccache_log_file)
+
+            # NOTE: separate steps to tell compilation time from the rest
+            for phase, target in [('make', 'all'), ('install', 'install')]:
+                args = [TOOL_MAKE, *make_opts, target]
+                self._execute_phase(phase, args, cwd=self.work_dir, **options)
 
-            for arg in [f'-j{jobs}', 'install']:
-                args = [TOOL_MAKE, arg]
-                execute(args, cwd=self.work_dir)
+            if CONFIG['build']['ccache']:
+                self.ccache_stats = read_stats_log(self.ccache_log_file)
 
             # update installed commit hash
             self.installed_commit_hash = self.actual_commit_hash
+            self.restored_artifact = None
+            self.update_metadata()
 
             step('Built and installed')
 
+    def _artifact_key(self, configure, extensions):
+        if not ArtifactStore.enabled():
+            return None
+
+        # NOTE: [] is a valid choice
+        if configure is None:
+            configure = self._configure_options()
+
+        return ArtifactStore.key(commit=self.actual_commit_hash,
+                                 configure=configure,
+                                 extensions=extensions,
+                                 cc=os.environ.get('CC', 'cc'))
+
+    def _maybe_restore_artifact(self, configure, key):
+        if not key:
+            return False
+
+        new_conf_opts = self._configure_options_are_new(configure)
+        if not (new_conf_opts or self.requires_reinstall):
+            return False
+
+        try:
+            with self.build_stats.phase('restore'):
+                if not ArtifactStore().restore(key, self.main_dir):
+                    return False
+        except LogicError as e:
+            step(Style.yellow(f'{e}, building from scratch'))
+            return False
+
+        # NOTE: built commit & work dir still belong to the previous build
+        self.installed_commit_hash = self.actual_commit_hash
+        self.restored_artifact = key
+        self.update_metadata()
+
+        # old main dir has been moved to trash
+        empty_trash()
+
+        step('Installed from artifact cache', key[:12])
+        return True
+
+    def _maybe_store_artifact(self, key):
+        # did we build anything?
+        if not key or 'install' not in self.build_stats.phases:
+            return
+
+        with self.build_stats.phase('store'):
+            ArtifactStore().store(key, self.main_dir)
+
+        step('Saved build to artifact cache', key[:12])
+
+    def _maybe_dedupe(self):
+        # did we install anything?
+        phases = self.build_stats.phases.keys()
+        if not CONFIG['build']['dedupe'] or \
+                not phases & {'install', 'restore', 'contrib'}:
+            return
+
+        with self.build_stats.phase('dedupe'):
+            linked, reclaimed = dedupe(installed_dirs(), only=self.main_dir)
+
+        if linked:
+            step('Hardlinked', linked, 'files shared with other builds,',
+                 'reclaimed', format_size(reclaimed))
+
     def _maybe_make_extensions(self, extensions=None):
         if extensions is None:
             return
 
         # provide defaults
         if not extensions:
-            path = os.path.join(self.work_dir, 'contrib')
+            path = os.path.join(self.src_dir, 'contrib')
             extensions = sorted((e for e in os.listdir(path)
                                  if os.path.isdir(os.path.join(path, e))))
 
+        with ExitStack() as stack:
+            # share job slots with concurrent builds, if any
+            jobserver = JobServer.current or \
+                stack.enter_context(JobServer(build_jobs()))
+            stack.enter_context(jobserver.lend_implicit_slot())
+
+            options = jobserver.make_options(self._build_env())
+
+            def make_install(extension):
+                # is it a contrib?
+                path = os.path.join(self.work_dir, 'contrib', extension)
+                log = self._log_file('contrib-' + extension.replace(os.sep, '-'))
+                with jobserver.slot():
+                    execute([TOOL_MAKE, 'install'],
+                            cwd=path,
+                            log=log,
+                            **options)
+
+            with self.build_stats.phase('contrib'), \
+                    ThreadPoolExecutor(max_workers=build_jobs()) as pool:
+                futures = [pool.submit(make_install, e) for e in extensions]
+
         failed = False
-        for extension in extensions:
-            # is it a contrib?
-            path = os.path.join(self.work_dir, 'contrib', extension)
+        for extension, future in zip(extensions, futures):
             try:
-                Extension(path).make('install')
+                future.result()
                 step('Installed contrib', Style.bold(extension))
-            except ProcessError:
+            except ProcessError as e:
                 step(Style.red(f'Failed to install {extension}'))
+                if e.stderr:
+                    eprint(limit_lines(e.stderr, 8))
+                if e.log:
+                    eprint('Full log:', e.log)
                 failed = True
 
         if failed:
             raise LogicError('Failed to install some extensions')
 
 
+def copy_data_dir(src, dst):
+    # NOTE: postgres modifies files in place, so no hardlinks here
+    args = ['cp', '-a', '--reflink=auto', src, dst]
+
+    try:
+        execute(args)
+    except ProcessError:
+        rmtree(path=dst, ignore_errors=True)
+        copytree(src, dst, symlinks=True)
+
+
+def init_temp_node(instance, node, temp_conf=''):
+    template = instance.initdb_template()
+    if template:
+        copy_data_dir(template, node.data_dir)
+        node.default_conf()
+    else:
+        node.init()
+
+    return node.append_conf(line=temp_conf)
+
+
+def read_config_files(config_files):
+    configs = []
+
+    for path in (f for f in config_files or [] if f is not None):
+        eprint('Custom config file:', os.path.basename(path))
+        with open(path) as f:
+            configs.append(f.read())
+
+    return '\n'.join(configs)
+
+
 @contextmanager
 def run_temp(instance, config_files=None, **kwargs):
+    # avoid circular import
+    from norsu.pool import lease_node
+
+    # NOTE: testgres takes a while to import
+    from testgres import get_new_node, configure_testgres
+
     pg_config = instance.get_bin_path('pg_config')
-    temp_conf = ''
 
     if not os.path.exists(pg_config):
         raise LogicError(f'Failed to find pg_config at {pg_config}')
@@ -401,15 +932,24 @@ def run_temp(instance, config_files=None, **kwargs):
     # disable instance caching
     configure_testgres(cache_initdb=False)
 
-    if config_files:
-        configs = []
+    temp_conf = read_config_files(config_files)
+
+    # pooled instances can't have custom settings
+    if not temp_conf and kwargs.get('port') is None:
+        with lease_node(instance) as leased:
+            if leased:
+                node = get_new_node(base_dir=leased['base_dir'],
+                                    port=leased['port'])
 
-        for path in (f for f in config_files if f is not None):
-            eprint('Custom config file:', os.path.basename(path))
-            with open(path) as f:
-                configs.append(f.read())
+                with redirect_stdout(sys.stderr):
+                    print('Using pooled PostgreSQL instance...')
+                    print()
+                    print('dir:', node.base_dir)
+                    print('port:', node.port)
+                    print()
 
-        temp_conf = '\n'.join(configs)
+                yield node
+                return
 
     with get_new_node(**kwargs) as node:
         with redirect_stdout(sys.stderr):
@@ -421,6 +961,6 @@ def run_temp(instance, config_files=None, **kwargs):
 
         # prepare and start a new node
         node.cleanup_on_bad_exit = True
-        node.init().append_conf(line=temp_conf).start()
+        init_temp_node(instance, node, temp_conf).start()
 
         yield node
@@ -0,0 +1,110 @@
+import os
+import re
+import select
+
+from contextlib import contextmanager
+from functools import lru_cache
+
+from norsu.config import TOOL_MAKE
+from norsu.exceptions import ProcessError
+from norsu.execute import execute
+
+
+@lru_cache(maxsize=None)
+def make_version():
+    """
+    Get version of GNU make as a tuple, e.g. (4, 3).
+    """
+
+    try:
+        out = execute([TOOL_MAKE, '--version'])
+    except (OSError, ProcessError):
+        return None
+
+    m = re.search(r'GNU Make (\d+)\.(\d+)', out or '')
+    if m:
+        return tuple(map(int, m.groups()))
+
+
+class JobServer:
+    """
+    GNU make jobserver shared by several concurrent builds.
+    """
+
+    # jobserver of the current command (inherited by forked workers)
+    current = None
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.fds = None
+
+    def __enter__(self):
+        r, w = os.pipe()
+
+        # NOTE: each top-level make owns an implicit job slot,
+        # so a lone active build may still use the whole budget
+        os.write(w, b'+' * max(self.jobs - 1, 0))
+
+        self.fds = (r, w)
+        JobServer.current = self
+        return self
+
+    def __exit__(self, *_):
+        JobServer.current = None
+
+        for fd in self.fds:
+            os.close(fd)
+
+    def _take_token(self):
+        r, _ = self.fds
+
+        # NOTE: make might have switched the pipe to non-blocking mode
+        while True:
+            select.select([r], [], [])
+            try:
+                return os.read(r, 1)
+            except BlockingIOError:
+                pass  # someone's been faster
+
+    @contextmanager
+    def slot(self):
+        """
+        Hold a job slot (wait until one is available).
+        """
+
+        token = self._take_token()
+        try:
+            yield
+        finally:
+            os.write(self.fds[1], token)
+
+    @contextmanager
+    def lend_implicit_slot(self):
+        """
+        Let slot() hand out the job slot owned by this process.
+        """
+
+        os.write(self.fds[1], b'+')
+        try:
+            yield
+        finally:
+            self._take_token()
+
+    def make_options(self, env=None):
+        """
+        Return kwargs for execute() making make join this jobserver.
+        """
+
+        r, w = self.fds
+
+        # NOTE: GNU make < 4.2 only knows --jobserver-fds
+        version = make_version()
+        if version and version < (4, 2):
+            option = 'jobserver-fds'
+        else:
+            option = 'jobserver-auth'
+
+        env = dict(env or os.environ)
+        env['MAKEFLAGS'] = f'-j --{option}={r},{w}'
+
+        return {'env': env, 'pass_fds': self.fds}
@@ -1,11 +1,11 @@
 import argparse
+import importlib
 import sys
 
-import norsu.commands as commands
-
 from norsu import __version__
 from norsu.exceptions import LogicError, ProcessError
 from norsu.terminal import Style
+from norsu.trash import empty_trash
 
 from norsu.args import (
     ShlexSplitAction,
@@ -32,15 +32,12 @@ examples:
     {app} status
     """
 
-    # Hint for all TARGET args
-    known_targets = commands.known_targets()
-
     parser = argparse.ArgumentParser(
         description=f'PostgreSQL builds manager v{__version__}',
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog=examples)
 
-    parser.set_defaults(func=None)
+    parser.set_defaults(func=None, module='norsu.commands')
 
     subparsers = parser.add_subparsers(title='commands', dest='command')
 
@@ -58,7 +55,15 @@ examples:
                            '--no-update',
                            action='store_true',
                            help='do not pull and install updates')
-    p_install.set_defaults(func=commands.cmd_install)
+    p_install.add_argument('-P',
+                           '--parallel',
+                           type=int,
+                           metavar='N',
+                           help='build up to N instances concurrently')
+    p_install.add_argument('--refresh',
+                           action='store_true',
+                           help='refresh cached lists of branches')
+    p_install.set_defaults(func='cmd_install')
 
     # norsu remove
     p_remove = subparsers.add_parser('remove',
@@ -67,31 +72,57 @@ examples:
     p_remove.add_argument('--force',
                           action='store_true',
                           help='force remove, even if no target')
-    p_remove.set_defaults(func=commands.cmd_instance)
+    p_remove.set_defaults(func='cmd_instance')
 
     # norsu status
     p_status = subparsers.add_parser(
         'status', description='show some info for each build installed')
     p_status.add_argument('target', nargs='*')
-    p_status.set_defaults(func=commands.cmd_instance)
+    p_status.add_argument('--json',
+                          action='store_true',
+                          help='print info in JSON format')
+    p_status.set_defaults(func='cmd_status')
+
+    # norsu stats
+    p_stats = subparsers.add_parser(
+        'stats', description='show timings of recent builds')
+    p_stats.add_argument('target', nargs='*')
+    p_stats.add_argument('-n',
+                         '--last',
+                         type=int,
+                         default=10,
+                         help='number of builds to show')
+    p_stats.add_argument('--json',
+                         action='store_true',
+                         help='print timings in JSON format')
+    p_stats.set_defaults(func='cmd_stats')
 
     # norsu pull
     p_pull = subparsers.add_parser(
         'pull', description='pull latest changes from git repos')
     p_pull.add_argument('target', nargs='*')
-    p_pull.set_defaults(func=commands.cmd_instance)
+    p_pull.set_defaults(func='cmd_pull')
 
     # norsu search
     p_search = subparsers.add_parser(
         'search', description='find matching branches in git repos')
     p_search.add_argument('target', nargs='*')
-    p_search.set_defaults(func=commands.cmd_search)
+    p_search.add_argument('--refresh',
+                          action='store_true',
+                          help='refresh cached lists of branches')
+    p_search.set_defaults(func='cmd_search')
 
     # norsu purge
     p_purge = subparsers.add_parser(
         'purge', description='remove orphaned cloned git repos')
     p_purge.add_argument('target', nargs='*')
-    p_purge.set_defaults(func=commands.cmd_purge)
+    p_purge.set_defaults(func='cmd_purge')
+
+    # norsu dedupe
+    p_dedupe = subparsers.add_parser(
+        'dedupe', description='hardlink identical files of builds')
+    p_dedupe.add_argument('target', nargs='*')
+    p_dedupe.set_defaults(func='cmd_dedupe')
 
     # norsu pgxs
     p_pgxs = subparsers.add_parser(
@@ -104,12 +135,17 @@ examples:
     p_pgxs.add_argument('--run-pg-port',
                         type=int,
                         help='port to be used for temp instance')
-    p_pgxs.set_defaults(func=commands.cmd_pgxs)
+    p_pgxs.add_argument('-P',
+                        '--parallel',
+                        type=int,
+                        metavar='N',
+                        help='run against up to N instances concurrently')
+    p_pgxs.set_defaults(func='cmd_pgxs')
 
     # norsu run
     p_run = subparsers.add_parser(
         'run', description='run a temp instance of PostgreSQL')
-    p_run.add_argument('target', choices=known_targets)
+    p_run.add_argument('target')
     p_run.add_argument('--config',
                        nargs='*',
                        help='additional config files for PostgreSQL')
@@ -140,21 +176,38 @@ examples:
                        metavar='FILENAME',
                        type=str,
                        help='restore a DB from a file')
-    p_run.set_defaults(func=commands.cmd_run)
+    p_run.set_defaults(func='cmd_run')
+
+    # norsu pool
+    p_pool = subparsers.add_parser(
+        'pool', description='keep running temp instances for run & pgxs')
+    p_pool.add_argument('action', choices=['start', 'stop', 'status'])
+    p_pool.add_argument('target', nargs='*')
+    p_pool.add_argument('-n',
+                        '--size',
+                        type=int,
+                        help='number of idle instances per build')
+    p_pool.set_defaults(func='cmd_pool')
 
     # norsu path
     p_path = subparsers.add_parser(
         'path', description='show paths to a specific build')
     p_path.add_argument('target', nargs='*')
-    p_path.set_defaults(func=commands.cmd_path)
+    p_path.set_defaults(func='cmd_path', module='norsu.targets')
 
     try:
         parsed_args = parser.parse_args(args[1:])
         command = parsed_args.func
 
+        # finish what previous commands have left
+        empty_trash()
+
         if command:
+            # NOTE: commands (and what they need) are imported on demand
+            commands = importlib.import_module(parsed_args.module)
+
             # execute a suitable command
-            command(parsed_args, extra)
+            getattr(commands, command)(parsed_args, extra)
         else:
             parser.print_help()
 
@@ -170,6 +223,8 @@ examples:
         if e.stderr:
             eprint('LOG:\n\n<... skipped lines ...>')
             eprint(limit_lines(e.stderr, 8))
+        if e.log:
+            eprint('\nFull log:', e.log)
         sys.exit(1)
 
     # XXX: We deliberately don't catch Exception,
@@ -0,0 +1,65 @@
+import multiprocessing
+import os
+import sys
+import tempfile
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from norsu.exceptions import LogicError, ProcessError
+from norsu.utils import eprint, limit_lines
+
+
+def _run_captured(func, item):
+    """
+    Call func(item), capturing everything written to
+    stdout & stderr (including child processes).
+    """
+
+    error = None
+    saved_fds = [os.dup(1), os.dup(2)]
+
+    with tempfile.TemporaryFile(mode='w+', errors='replace') as f:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        os.dup2(f.fileno(), 1)
+        os.dup2(f.fileno(), 2)
+
+        try:
+            func(item)
+        except (LogicError, ProcessError) as e:
+            error = str(e) or 'Failed to execute a command'
+
+            if getattr(e, 'stderr', None):
+                eprint('LOG:\n\n<... skipped lines ...>')
+                eprint(limit_lines(e.stderr, 8))
+            if getattr(e, 'log', None):
+                eprint('\nFull log:', e.log)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+            for i, fd in enumerate(saved_fds, start=1):
+                os.dup2(fd, i)
+                os.close(fd)
+
+        f.seek(0)
+        return f.read(), error
+
+
+def run_parallel(func, items, workers):
+    """
+    Call func(item) for each item using a pool of forked workers.
+    Yield (item, output, error) in order of completion.
+    """
+
+    # NOTE: fork is required to share inherited fds (e.g. jobserver)
+    context = multiprocessing.get_context('fork')
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=context) as pool:
+        futures = {pool.submit(_run_captured, func, x): x for x in items}
+
+        for future in as_completed(futures):
+            output, error = future.result()
+            yield futures[future], output, error
@@ -0,0 +1,380 @@
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+
+from norsu.config import WORK_DIR
+from norsu.exceptions import LogicError
+
+
+POOL_SOCKET = os.path.join(WORK_DIR, '.pool.sock')
+POOL_LOG = os.path.join(WORK_DIR, '.pool.log')
+
+# databases which survive a reset of a pooled node (others are dropped)
+TEMPLATE_DBS = ['template0', 'template1']
+
+# roles with lesser oids are built-in (see FirstNormalObjectId)
+FIRST_NORMAL_OID = 16384
+
+# how long a reset may wait for client backends to exit (seconds)
+RESET_TIMEOUT = 30
+
+
+def quote_ident(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def send_request(sock, request):
+    sock.sendall(json.dumps(request).encode('utf8') + b'\n')
+    response = sock.makefile('rb').readline()
+    if not response:
+        raise LogicError('Node pool has closed connection')
+
+    return json.loads(response.decode('utf8'))
+
+
+def connect(timeout=None):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+
+    try:
+        sock.connect(POOL_SOCKET)
+        return sock
+    except OSError:
+        sock.close()
+        return None
+
+
+@contextmanager
+def lease_node(instance):
+    """
+    Borrow a running node from the pool (yield None if there's none).
+    The node is returned to the pool once the connection is closed.
+    """
+
+    sock = connect()
+    if not sock:
+        yield None
+        return
+
+    try:
+        response = send_request(sock, {
+            'op': 'lease',
+            'target': str(instance.name),
+        })
+
+        yield response if 'error' not in response else None
+    finally:
+        sock.close()
+
+
+class NodePool:
+    """
+    A set of running temp nodes for each target.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.idle = {}  # target => [(commit, node), ...]
+        self.leased = {}  # target => number of leased nodes
+        self.filling = set()  # targets being filled right now
+
+    def _new_node(self, instance):
+        # avoid circular import
+        from norsu.instance import init_temp_node
+        from testgres import get_new_node
+
+        # HACK: help testgres find our instance
+        with self.lock:
+            os.environ['PG_CONFIG'] = instance.get_bin_path('pg_config')
+            node = get_new_node()
+
+        init_temp_node(instance, node).start()
+        return instance.installed_commit_hash, node
+
+    @staticmethod
+    def _discard(node):
+        try:
+            node.cleanup()
+        except Exception as e:
+            print('Failed to clean up node:', e)
+
+    @staticmethod
+    def _reset(node):
+        """
+        Bring a node back to the state of a fresh initdb (almost).
+        """
+
+        def psql(query, dbname='template1'):
+            # NOTE: 'postgres' is about to be dropped
+            return node.safe_psql(query, dbname=dbname).decode('utf8')
+
+        psql('alter system reset all')
+        psql('select pg_reload_conf()')
+
+        # kill whatever the client has left behind and wait for it to exit,
+        # since backends might still be around when we drop their databases
+        deadline = time.time() + RESET_TIMEOUT
+        while int(psql('select count(pg_terminate_backend(pid)) '
+                       'from pg_stat_activity '
+                       'where pid <> pg_backend_pid() '
+                       'and datname is not null')):
+            if time.time() > deadline:
+                raise LogicError('Backends are still running')
+            time.sleep(0.1)
+
+        query = 'select datname from pg_database where datname not in ({})'
+        query = query.format(', '.join(f"'{db}'" for db in TEMPLATE_DBS))
+
+        for db in psql(query).splitlines():
+            psql(f'drop database {quote_ident(db)}')
+
+        psql('create database postgres template template0')
+
+        # new databases would inherit whatever the client put to template1
+        for query in [
+            "update pg_database set datistemplate = false "
+            "where datname = 'template1'",
+            'drop database template1',
+            'create database template1 template template0',
+            "update pg_database set datistemplate = true "
+            "where datname = 'template1'",
+        ]:
+            psql(query, dbname='postgres')
+
+        query = f'select rolname from pg_roles where oid >= {FIRST_NORMAL_OID}'
+        for role in psql(query).splitlines():
+            psql(f'drop owned by {quote_ident(role)}')
+            psql(f'drop role {quote_ident(role)}')
+
+    def fill(self, instance):
+        target = str(instance.name)
+
+        with self.lock:
+            if target in self.filling:
+                return
+            self.filling.add(target)
+
+            # from now on the pool serves this target
+            self.idle.setdefault(target, [])
+
+        try:
+            while len(self.idle[target]) < self.size:
+                entry = self._new_node(instance)
+                with self.lock:
+                    # a released node might have taken its place
+                    idle = self.idle[target]
+                    spare = len(idle) >= self.size
+                    if not spare:
+                        idle.append(entry)
+
+                if spare:
+                    self._discard(entry[1])
+                    break
+
+                print('Started node for', target, 'at port', entry[1].port)
+        finally:
+            with self.lock:
+                self.filling.discard(target)
+
+    def lease(self, instance):
+        target = str(instance.name)
+        commit = instance.installed_commit_hash
+        stale = []
+
+        with self.lock:
+            # we don't start nodes for targets nobody asked us to pool
+            idle = self.idle.get(target)
+            if idle is None:
+                return None
+
+            # nodes of previous builds are useless
+            stale = [e for e in idle if e[0] != commit]
+            idle[:] = [e for e in idle if e[0] == commit]
+
+            entry = idle.pop() if idle else None
+            if entry:
+                self.leased[target] = self.leased.get(target, 0) + 1
+
+            refill = target not in self.filling
+
+        for _, node in stale:
+            self._discard(node)
+
+        # replace nodes we've just taken or discarded
+        if refill:
+            threading.Thread(target=self.fill, args=(instance, )).start()
+
+        return entry
+
+    def release(self, instance, entry):
+        target = str(instance.name)
+        _, node = entry
+
+        with self.lock:
+            self.leased[target] -= 1
+
+        try:
+            self._reset(node)
+        except Exception as e:
+            print('Failed to reset node for', target, e)
+            self._discard(node)
+            return
+
+        with self.lock:
+            # NOTE: pool might be closing
+            idle = self.idle.get(target)
+            if idle is not None and len(idle) < self.size:
+                idle.append(entry)
+                return
+
+        self._discard(node)
+
+    def status(self):
+        with self.lock:
+            targets = set(self.idle) | set(self.leased)
+            return {
+                t: {
+                    'idle': len(self.idle.get(t, [])),
+                    'leased': self.leased.get(t, 0),
+                }
+                for t in sorted(targets)
+            }
+
+    def close(self):
+        with self.lock:
+            entries = [e for idle in self.idle.values() for e in idle]
+            self.idle = {}
+
+        for _, node in entries:
+            self._discard(node)
+
+
+class PoolRequestHandler(socketserver.StreamRequestHandler):
+    def _respond(self, response):
+        self.wfile.write(json.dumps(response).encode('utf8') + b'\n')
+
+    def handle(self):
+        # avoid circular import
+        from norsu.instance import Instance
+
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        request = json.loads(line.decode('utf8'))
+        pool = self.server.pool
+        op = request.get('op')
+
+        if op == 'lease':
+            instance = Instance(request['target'])
+            entry = pool.lease(instance)
+            if not entry:
+                self._respond({'error': 'No idle nodes'})
+                return
+
+            _, node = entry
+            self._respond({'port': node.port, 'base_dir': node.base_dir})
+
+            # wait until client has finished
+            try:
+                while self.rfile.readline():
+                    pass
+            finally:
+                pool.release(instance, entry)
+
+        elif op == 'status':
+            self._respond(pool.status())
+
+        elif op == 'stop':
+            self._respond({'ok': True})
+            threading.Thread(target=self.server.shutdown).start()
+
+        else:
+            self._respond({'error': f'Unknown operation {op}'})
+
+
+class PoolServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, pool):
+        super().__init__(POOL_SOCKET, PoolRequestHandler)
+        self.pool = pool
+
+
+def _serve(instances, size):
+    pool = NodePool(size)
+    server = PoolServer(pool)
+
+    try:
+        # start nodes in background, clients will fall back meanwhile
+        for instance in instances:
+            threading.Thread(target=pool.fill, args=(instance, )).start()
+
+        server.serve_forever()
+    finally:
+        server.server_close()
+        pool.close()
+
+        if os.path.exists(POOL_SOCKET):
+            os.remove(POOL_SOCKET)
+
+
+def start_pool(instances, size, timeout=10):
+    sock = connect()
+    if sock:
+        sock.close()
+        raise LogicError('Node pool is already running')
+
+    # remove a leftover of a crashed pool
+    if os.path.exists(POOL_SOCKET):
+        os.remove(POOL_SOCKET)
+
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+
+        # wait for pool to become available
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            sock = connect()
+            if sock:
+                sock.close()
+                return
+            time.sleep(0.1)
+
+        raise LogicError(f'Failed to start node pool, see {POOL_LOG}')
+
+    # detach from terminal
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+
+    with open(POOL_LOG, 'a') as log, open(os.devnull, 'r') as null:
+        os.dup2(null.fileno(), 0)
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+
+    sys.stdout.reconfigure(line_buffering=True)
+
+    try:
+        _serve(instances, size)
+    finally:
+        os._exit(0)
+
+
+def request_pool(op):
+    sock = connect()
+    if not sock:
+        raise LogicError('Node pool is not running')
+
+    try:
+        return send_request(sock, {'op': op})
+    finally:
+        sock.close()
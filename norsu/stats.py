@@ -0,0 +1,115 @@
+import json
+import os
+import resource
+import statistics
+import time
+
+from contextlib import contextmanager
+
+
+# phases of a build, in order of execution
+PHASES = [
+    'clone', 'pull', 'restore', 'distclean', 'configure', 'make', 'install',
+    'contrib', 'store', 'dedupe',
+]
+
+# a phase is slower than usual if it exceeds median by this factor...
+REGRESSION_FACTOR = 1.2
+
+# ... and it's not just noise (seconds)
+REGRESSION_MIN_DELTA = 5.0
+
+
+def _children_usage():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+
+
+class BuildStats:
+    """
+    Wall & CPU time of build phases (CPU time and peak RSS are
+    taken from child processes, e.g. make, cc and git).
+    """
+
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        wall_start = time.monotonic()
+        cpu_start, _ = _children_usage()
+
+        yield
+
+        cpu_end, max_rss = _children_usage()
+
+        # NOTE: phase may happen more than once
+        entry = self.phases.setdefault(name, {'wall': 0, 'cpu': 0, 'rss': 0})
+        entry['wall'] += time.monotonic() - wall_start
+        entry['cpu'] += cpu_end - cpu_start
+
+        # NOTE: it's a peak RSS of children so far (in KiB)
+        entry['rss'] = max(entry['rss'], max_rss)
+
+    def record(self, path, **kwargs):
+        if not self.phases:
+            return
+
+        entry = {
+            'time': int(time.time()),
+            'phases': {
+                name: {k: round(v, 2) for k, v in values.items()}
+                for name, values in self.phases.items()
+            },
+            **kwargs,
+        }
+
+        with open(path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+
+def read_stats(path):
+    if not os.path.exists(path):
+        return []
+
+    entries = []
+    with open(path) as f:
+        for ln in f:
+            try:
+                entries.append(json.loads(ln))
+            except ValueError:
+                pass  # e.g. a partially written line
+
+    return entries
+
+
+def total_time(entry, key='wall'):
+    return sum(p[key] for p in entry['phases'].values())
+
+
+def find_regressions(entries):
+    """
+    Compare the latest build to the median of previous ones.
+    Returns a dict: phase => (seconds, median).
+    """
+
+    if len(entries) < 2:
+        return {}
+
+    *history, latest = entries
+    regressions = {}
+
+    for name, values in latest['phases'].items():
+        previous = [e['phases'][name]['wall'] for e in history
+                    if name in e['phases']]
+        if not previous:
+            continue
+
+        median = statistics.median(previous)
+        wall = values['wall']
+
+        if wall > median * REGRESSION_FACTOR and \
+                wall - median > REGRESSION_MIN_DELTA:
+            regressions[name] = (wall, median)
+
+    return regressions
@@ -0,0 +1,92 @@
+import os
+import re
+
+from enum import Enum
+
+from norsu.config import NORSU_DIR
+from norsu.exceptions import LogicError
+from norsu.utils import partition
+
+
+def target_dir(name):
+    return os.path.join(NORSU_DIR, str(name))
+
+
+class InstanceNameType(Enum):
+    Version = 1
+    Branch = 2
+
+
+class InstanceName:
+    rx_is_ver = re.compile(r'\d+([._]\d+)*')
+    rx_sep = re.compile(r'(\.|_)')
+
+    @staticmethod
+    def _check_str(s):
+        pred1 = len(s.strip()) > 0
+        pred2 = any(c.isalnum() for c in s)
+
+        if not (pred1 and pred2):
+            raise LogicError('Bad identifier: {s}')
+
+        return s
+
+    def __init__(self, name, query=None):
+        self.value = self._check_str(name)
+        self.query = self._check_str(query or name)
+
+        if self.rx_is_ver.match(self.query):
+            self.type = InstanceNameType.Version
+        else:
+            self.type = InstanceNameType.Branch
+
+    def to_patterns(self):
+        pattern = self.query
+        result = [pattern]
+
+        if self.type == InstanceNameType.Version:
+            # replace version separators with a pattern
+            pattern = self.rx_sep.sub(lambda m: '[._]', pattern)
+
+            result.extend([
+                f'REL_{pattern}*',
+                f'REL{pattern}*',
+            ])
+        else:
+            result.append(f'*{pattern}*')
+
+        return result
+
+    def __str__(self):
+        return self.value
+
+
+def known_targets(directory=NORSU_DIR):
+    # NOTE: skip stray files, e.g. locks left by older versions
+    return {
+        e for e in os.listdir(directory)
+        if not e.startswith('.') and os.path.isdir(os.path.join(directory, e))
+    }
+
+
+def preprocess_targets(raw_targets, directory=NORSU_DIR):
+    entries_pos, entries_neg = partition(lambda x: x.startswith('^'),
+                                         raw_targets)
+
+    entries_neg = set((e[1:] for e in entries_neg))  # remove '^'
+    entries_pos = set(entries_pos)
+
+    if not entries_pos or entries_neg:
+        entries_pos = known_targets(directory=directory)
+
+    entries = []
+    for e in sorted(entries_pos - entries_neg):
+        name, _, query = e.partition(':')
+        entries.append(InstanceName(name=name, query=query))
+
+    return entries
+
+
+def cmd_path(args, _):
+    for target in preprocess_targets(args.target):
+        print(target_dir(target))
@@ -1,5 +1,10 @@
 import os
+import shutil
 import signal
+import sys
+import time
+
+from contextlib import contextmanager
 
 from norsu.config import CONFIG
 
@@ -32,6 +37,51 @@ class Style:
         return Style.style(33, text)
 
 
+class Progress:
+    """
+    Show the latest line of output in place of the previous one.
+    """
+
+    # don't redraw more often than this (seconds)
+    interval = 0.1
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.shown = 0
+
+    def __call__(self, line):
+        now = time.monotonic()
+        if now - self.shown < self.interval:
+            return
+
+        self.shown = now
+
+        width = shutil.get_terminal_size().columns - len(self.prefix) - 1
+        sys.stderr.write('\r\033[K' + self.prefix + line[:max(width, 0)])
+        sys.stderr.flush()
+
+    def clear(self):
+        sys.stderr.write('\r\033[K')
+        sys.stderr.flush()
+
+
+@contextmanager
+def progress_line(prefix):
+    """
+    Yield a Progress (or None if stderr is not a terminal).
+    """
+
+    if not os.isatty(2) or not CONFIG['misc']['progress']:
+        yield None
+        return
+
+    progress = Progress(prefix)
+    try:
+        yield progress
+    finally:
+        progress.clear()
+
+
 def give_terminal_to(pgid):
     signals = {
         signal.SIGTTOU,
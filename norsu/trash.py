@@ -0,0 +1,99 @@
+import errno
+import fcntl
+import os
+
+from shutil import rmtree
+
+from norsu.config import WORK_DIR
+
+
+# directories are moved here to be removed in background
+TRASH_DIR = os.path.join(WORK_DIR, '.trash')
+
+
+def dir_size(path):
+    total = 0
+
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+
+    return total
+
+
+def move_to_trash(path):
+    """
+    Atomically get rid of a directory, it'll be removed by empty_trash().
+    """
+
+    os.makedirs(TRASH_DIR, exist_ok=True)
+    name = f'{os.path.basename(path)}-{os.urandom(4).hex()}'
+
+    try:
+        os.rename(path, os.path.join(TRASH_DIR, name))
+    except OSError as e:
+        # can't move it to another file system
+        if e.errno != errno.EXDEV:
+            raise
+        rmtree(path=path, ignore_errors=True)
+
+
+def _remove_all():
+    # NOTE: these are slow to import, don't do it for every command
+    from concurrent.futures import ThreadPoolExecutor
+    from norsu.aio import concurrency
+
+    lock_file = f'{TRASH_DIR}.lock'
+
+    with open(lock_file, 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return  # someone is already on it
+
+        # NOTE: new entries may arrive meanwhile
+        while True:
+            names = os.listdir(TRASH_DIR)
+            if not names:
+                break
+
+            def remove(name):
+                rmtree(path=os.path.join(TRASH_DIR, name), ignore_errors=True)
+
+            with ThreadPoolExecutor(max_workers=concurrency()) as pool:
+                pool.map(remove, names)
+
+            # rmtree has failed, don't try again & again
+            if set(names) & set(os.listdir(TRASH_DIR)):
+                break
+
+
+def empty_trash():
+    """
+    Remove everything in trash using a detached process.
+    """
+
+    if not os.path.isdir(TRASH_DIR) or not os.listdir(TRASH_DIR):
+        return
+
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+
+    # detach from terminal, so that we won't get ^C
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+
+    with open(os.devnull, 'r+') as null:
+        for fd in range(3):
+            os.dup2(null.fileno(), fd)
+
+    try:
+        _remove_all()
+    finally:
+        os._exit(0)
@@ -1,7 +1,9 @@
+import fcntl
 import os
 import shlex
 import sys
 
+from contextlib import contextmanager
 from itertools import tee, filterfalse
 from typing import Dict, Optional
 
@@ -30,3 +32,40 @@ def eprint(*args, **kwargs) -> None:
 
 def limit_lines(string: str, n: int) -> str:
     return '\n'.join(string.splitlines()[-n:])
+
+
+def format_size(size: int) -> str:
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'TiB'
+
+    return f'{size:.1f} {unit}' if unit != 'B' else f'{size} B'
+
+
+def rotate_file(path: str, keep: int) -> None:
+    """
+    Rename path to path.1 (path.1 to path.2 etc), keeping at most
+    keep old copies.
+    """
+
+    for i in range(keep, 0, -1):
+        old = f'{path}.{i - 1}' if i > 1 else path
+        if os.path.exists(old):
+            os.replace(old, f'{path}.{i}')
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Hold an exclusive lock on a file (shared with other processes).
+    """
+
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -16,6 +16,9 @@ flake8 .
 # install package
 pip install -U .
 
+# run unit tests
+python -m unittest discover -s unittests
+
 # run tests
 ./tester.sh
 
@@ -0,0 +1,121 @@
+import os
+import tempfile
+import unittest
+
+# NOTE: norsu.config creates its dirs on import
+os.environ['NORSU_PATH'] = tempfile.mkdtemp(prefix='norsu_test_')
+
+from norsu.artifacts import ArtifactStore, relocate  # noqa: E402
+from norsu.exceptions import LogicError  # noqa: E402
+
+
+class RelocateTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_text_files(self):
+        path = self.write('Makefile.global',
+                          b'prefix = /old/pg\nlibdir = /old/pg/lib\n')
+
+        relocate(self.dir, '/old/pg', '/new/prefix/pg')
+
+        self.assertEqual(self.read(path),
+                         b'prefix = /new/prefix/pg\n'
+                         b'libdir = /new/prefix/pg/lib\n')
+
+    def test_binaries(self):
+        data = (b'\x7fELF\0'
+                b'/old/pg/lib\0'
+                b'-L/old/pg/lib -Wl,-rpath,/old/pg/lib\0'
+                b'unrelated\0')
+        path = self.write('pg_config', data)
+
+        relocate(self.dir, '/old/pg', '/new')
+
+        self.assertEqual(self.read(path),
+                         b'\x7fELF\0'
+                         b'/new/lib\0\0\0\0'
+                         b'-L/new/lib -Wl,-rpath,/new/lib\0\0\0\0\0\0\0'
+                         b'unrelated\0')
+
+        # offsets of other data must stay intact
+        self.assertEqual(len(self.read(path)), len(data))
+
+    def test_prefix_too_long(self):
+        data = b'\x7fELF\0/old/pg/lib\0'
+        path = self.write('postgres', data)
+
+        with self.assertRaises(LogicError):
+            relocate(self.dir, '/old/pg', '/much/longer/prefix')
+
+        self.assertEqual(self.read(path), data)
+
+    def test_symlinks_are_skipped(self):
+        target = self.write('target', b'/old/pg\n')
+        os.symlink(target, os.path.join(self.dir, 'link'))
+
+        relocate(self.dir, '/old/pg', '/new/pg')
+
+        self.assertEqual(self.read(target), b'/new/pg\n')
+        self.assertEqual(os.readlink(os.path.join(self.dir, 'link')), target)
+
+
+class ArtifactStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = ArtifactStore(path=os.path.join(self.tmp.name, 'store'),
+                                   max_size='1G')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def test_restore_replaces_main_dir(self):
+        build = os.path.join(self.tmp.name, 'build')
+        self.write(os.path.join(build, 'lib', 'new.so'), f'{build}/lib')
+        self.store.store('k' * 40, build)
+
+        main_dir = os.path.join(self.tmp.name, 'main')
+        self.write(os.path.join(main_dir, 'lib', 'old.so'), 'old')
+        self.write(os.path.join(main_dir, '.norsu_stats'), 'history')
+
+        self.assertTrue(self.store.restore('k' * 40, main_dir))
+
+        # nothing is left of the previous build but norsu's files
+        self.assertEqual(sorted(os.listdir(main_dir)), ['.norsu_stats', 'lib'])
+        self.assertEqual(os.listdir(os.path.join(main_dir, 'lib')), ['new.so'])
+
+        with open(os.path.join(main_dir, 'lib', 'new.so')) as f:
+            self.assertEqual(f.read(), f'{main_dir}/lib')
+
+        with open(os.path.join(main_dir, '.norsu_stats')) as f:
+            self.assertEqual(f.read(), 'history')
+
+        self.assertEqual(os.stat(main_dir).st_mode & 0o777, 0o755)
+
+    def test_restore_missing(self):
+        main_dir = os.path.join(self.tmp.name, 'main')
+        self.assertFalse(self.store.restore('k' * 40, main_dir))
+        self.assertFalse(os.path.exists(main_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
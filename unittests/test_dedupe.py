@@ -0,0 +1,183 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+# NOTE: norsu.config creates its dirs on import
+os.environ['NORSU_PATH'] = tempfile.mkdtemp(prefix='norsu_test_')
+
+import norsu.dedupe  # noqa: E402
+from norsu.dedupe import dedupe  # noqa: E402
+
+
+class DedupeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+        index = os.path.join(self.dir, 'index.json')
+        patcher = mock.patch.object(norsu.dedupe, 'INDEX_FILE', index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # count files we had to hash
+        self.hashed = []
+        file_hash = norsu.dedupe.file_hash
+
+        def counting_hash(path):
+            self.hashed.append(path)
+            return file_hash(path)
+
+        patcher = mock.patch.object(norsu.dedupe, 'file_hash', counting_hash)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def main_dir(self, name):
+        path = os.path.join(self.dir, name)
+        os.makedirs(os.path.join(path, 'lib'))
+        return path
+
+    def write(self, main_dir, name, data):
+        path = os.path.join(main_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def same(self, a, b):
+        return os.stat(a).st_ino == os.stat(b).st_ino
+
+    def test_identical_files(self):
+        a, b = self.main_dir('a'), self.main_dir('b')
+        fa = self.write(a, 'lib/libpq.so', b'x' * 8192)
+        fb = self.write(b, 'lib/libpq.so', b'x' * 8192)
+        other = self.write(b, 'lib/other.so', b'y' * 8192)
+
+        linked, reclaimed = dedupe([a, b])
+
+        self.assertEqual(linked, 1)
+        self.assertGreater(reclaimed, 0)
+        self.assertTrue(self.same(fa, fb))
+        self.assertFalse(self.same(fa, other))
+
+        # nothing left to do
+        self.assertEqual(dedupe([a, b]), (0, 0))
+
+    def test_ignored_files(self):
+        a, b = self.main_dir('a'), self.main_dir('b')
+        fa = self.write(a, '.norsu_commit', b'abc')
+        fb = self.write(b, '.norsu_commit', b'abc')
+        ea = self.write(a, 'lib/empty', b'')
+        eb = self.write(b, 'lib/empty', b'')
+
+        self.assertEqual(dedupe([a, b]), (0, 0))
+        self.assertFalse(self.same(fa, fb))
+        self.assertFalse(self.same(ea, eb))
+
+    def test_index_reuse(self):
+        a, b = self.main_dir('a'), self.main_dir('b')
+        fa = self.write(a, 'lib/x', b'data')
+        self.write(b, 'lib/x', b'diff')
+        self.write(a, 'lib/y', b'same')
+        self.write(b, 'lib/y', b'same')
+
+        dedupe([a, b])
+        self.assertEqual(len(self.hashed), 4)
+
+        # unchanged files are not hashed again
+        self.hashed.clear()
+        dedupe([a, b])
+        self.assertEqual(self.hashed, [])
+
+        # but modified ones are
+        with open(fa, 'wb') as f:
+            f.write(b'diff')
+        os.utime(fa, ns=(0, 0))
+
+        linked, _ = dedupe([a, b])
+        self.assertEqual(self.hashed, [fa])
+        self.assertEqual(linked, 1)
+
+    def test_mode_mismatch(self):
+        a, b = self.main_dir('a'), self.main_dir('b')
+        fa = self.write(a, 'lib/x', b'data')
+        fb = self.write(b, 'lib/x', b'data')
+        os.chmod(fa, 0o755)
+        os.chmod(fb, 0o644)
+
+        self.assertEqual(dedupe([a, b]), (0, 0))
+        self.assertFalse(self.same(fa, fb))
+        self.assertEqual(os.stat(fb).st_mode & 0o777, 0o644)
+
+    @unittest.skipUnless(os.geteuid() == 0, 'chown requires root')
+    def test_owner_mismatch(self):
+        a, b = self.main_dir('a'), self.main_dir('b')
+        fa = self.write(a, 'lib/x', b'data')
+        fb = self.write(b, 'lib/x', b'data')
+        os.chown(fb, 1, 1)
+
+        self.assertEqual(dedupe([a, b]), (0, 0))
+        self.assertFalse(self.same(fa, fb))
+        self.assertEqual(os.stat(fb).st_uid, 1)
+
+    def test_changed_after_hashing(self):
+        a, b = self.main_dir('a'), self.main_dir('b')
+        fa = self.write(a, 'lib/x', b'data')
+        fb = self.write(b, 'lib/x', b'data')
+
+        file_hash = norsu.dedupe.file_hash
+
+        # e.g. a concurrent build rewrites the file
+        def racing_hash(path):
+            res = file_hash(path)
+            if path == fb:
+                with open(fb, 'wb') as f:
+                    f.write(b'DATA')
+                os.utime(fb, ns=(0, 0))
+            return res
+
+        with mock.patch.object(norsu.dedupe, 'file_hash', racing_hash):
+            self.assertEqual(dedupe([a, b]), (0, 0))
+
+        self.assertFalse(self.same(fa, fb))
+        with open(fb, 'rb') as f:
+            self.assertEqual(f.read(), b'DATA')
+
+    def test_only(self):
+        a, b, c = self.main_dir('a'), self.main_dir('b'), self.main_dir('c')
+        fa = self.write(a, 'lib/x', b'data')
+        fb = self.write(b, 'lib/x', b'data')
+        fc = self.write(c, 'lib/x', b'data')
+        ga = self.write(a, 'lib/y', b'more')
+        gb = self.write(b, 'lib/y', b'more')
+
+        linked, reclaimed = dedupe([a, b, c], only=c)
+
+        self.assertEqual(linked, 1)
+        self.assertGreater(reclaimed, 0)
+
+        # files of other builds are left intact
+        self.assertFalse(self.same(fa, fb))
+        self.assertFalse(self.same(ga, gb))
+
+        # but ours are linked to one of them
+        self.assertTrue(self.same(fc, fa) or self.same(fc, fb))
+
+    def test_only_prefix(self):
+        a, ab = self.main_dir('a'), self.main_dir('ab')
+        fa = self.write(a, 'lib/x', b'data')
+        fab = self.write(ab, 'lib/x', b'data')
+        ino = os.stat(fab).st_ino
+
+        # 'ab' must not be mistaken for a file of 'a'
+        linked, _ = dedupe([a, ab], only=a)
+
+        self.assertEqual(linked, 1)
+        self.assertEqual(os.stat(fab).st_ino, ino)
+        self.assertEqual(os.stat(fa).st_ino, ino)
+
+
+if __name__ == '__main__':
+    unittest.main()